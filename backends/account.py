@@ -1,18 +1,21 @@
 # quantum-computed-chemistry/backend/account.py
 # Handles connecting to IBMQ backends
+#   NB. the provider, Aer and mock devices are imported only when a backend that needs them is requested, so importing the package is fast
 
 #core
 from warnings import warn
 from importlib import import_module
 
-#qiskit
-from qiskit import IBMQ, Aer
-from qiskit.providers.aer import QasmSimulator, noise
+#qcchem
+from .cache import LRUCache
 
 #define ACCOUNT as a global variable so that login is required only once per session
 global ACCOUNT
 ACCOUNT=None
 
+#backends that have already been constructed (keyed by lower case name) so that repeated requests return the same backend
+BACKENDS=LRUCache(maxsize=32)
+
 def load(**kwargs):
     """
     load IBMQ account:
@@ -21,6 +24,7 @@ def load(**kwargs):
     returns:
         the qiskit account
     """
+    from qiskit import IBMQ
     global ACCOUNT
     if not len(kwargs): kwargs={'hub':'ibm-q-melbourne'}
     IBMQ.load_account()
@@ -53,7 +57,23 @@ def get_backend(name):
             'fake(XXX)' where XXX is the name of an IBMQ backend (without prefix), e.g. 'fake(montreal)':
                 alternatively 'fake_montreal' or 'qasm_simulator(fake_montreal)'
             'simX' where 'X' is a number: a simulated backend with depolarising and readout errors at X times device level
-    returns: the first backend matching the criteria
+    returns: the first backend matching the criteria, backends are memoized so requesting the same name again returns the same backend (see clear)
+    """
+    backend=BACKENDS.get(name.lower())
+    if backend is None:
+        backend=_get_backend(name)
+        BACKENDS[name.lower()]=backend
+    return backend
+
+def clear():
+    """
+    Forget all memoized backends, so that subsequent calls to get_backend construct new backends
+    """
+    BACKENDS.clear()
+
+def _get_backend(name):
+    """
+    construct a backend (should be called through get_backend)
     """
     if name[:5].lower()=='fake_': return _get_aer_from_device(name[5:])
     elif name[:5].lower()=='fake(': return _get_aer_from_device(name[5:-1])
@@ -70,12 +90,14 @@ def _get_aer_from_device(name):
     """
     return a simulated version of the device (should be called through get_backend)
     """
+    from qiskit.providers.aer import QasmSimulator
     return QasmSimulator.from_backend(getattr(import_module('qiskit.test.mock'),'Fake'+name[0].upper()+name[1:])(),method='automatic')
     
 def _get_aer_from_model(name):
     """
     return a simulated device with depolarising and readout error (should be called through get_backend)
     """
+    from qiskit.providers.aer import QasmSimulator, noise
     try: level=float(name[3:])
     except ValueError: (level,name)=(0,'sim0')
     p1=0.001*level
@@ -107,5 +129,5 @@ def _get_aer_statevector(name):
     """
     return a statevector simulator
     """
+    from qiskit import Aer
     return Aer.get_backend(name)
-
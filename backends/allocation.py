@@ -0,0 +1,79 @@
+# quantum-computed-chemistry/backends/allocation.py
+# Distributes a shot budget over measurement bases to minimise the shot noise of the energy
+
+#core
+from copy import copy
+from math import ceil
+
+#numpy
+from numpy import zeros,sqrt,floor,full,argsort
+
+#qcchem
+from .estimator import _group_terms,_basis_energy
+
+def basis_deviations(hamiltonian,bases,lookup=None,mitigator=None):
+    """
+    The single shot standard deviation of the part of a Hamiltonian measured in each basis
+        bases with results assigned (e.g. from a pilot run) use the measured variance, other bases use the bound sum(|coefficients|) of the terms they measure
+    arguments:
+        hamiltonian (dict): Pauli strings as keys and coefficients as values
+        bases (iterable of PauliBasis): the measurement bases
+        lookup, optional (dict): maps each term to its basis (see estimator.energy)
+        mitigator, optional (mitigation.ReadoutMitigator): if provided, the variances of the readout corrected estimates are used
+    returns:
+        numpy.ndarray, shape (n_bases,)
+    """
+    bases=tuple(bases)
+    index={basis:ix for ix,basis in enumerate(bases)}
+    sigma=zeros(len(bases))
+    for basis,terms in _group_terms(hamiltonian,bases,lookup):
+        try: counts=basis.results
+        except AttributeError: counts=None
+        if counts is None: sigma[index[basis]]=sum(abs(coeff) for _,coeff in terms)
+        else:
+            _,var=_basis_energy(counts,terms,mitigator)
+            sigma[index[basis]]=sqrt(var*sum(counts.values()))
+    return sigma
+
+def allocate_shots(hamiltonian,bases,lookup=None,total=None,target=None,min_shots=100,mitigator=None):
+    """
+    Choose the number of shots of each basis, proportional to the standard deviation of the terms it measures (which minimises the variance of the energy for a fixed total)
+        the variance of the energy is then sum(sigma)**2/total, compared to n_bases*sum(sigma**2)/total for equal shots
+    arguments:
+        hamiltonian (dict): Pauli strings as keys and coefficients as values
+        bases (iterable of PauliBasis): the measurement bases, with results assigned from a pilot run to use measured variances (see basis_deviations)
+        lookup, optional (dict): maps each term to its basis (see estimator.energy)
+        total, optional (int): the total number of shots over all bases
+        target, optional (float): the required standard error of the energy (exactly one of total and target must be given)
+        min_shots (int, default 100): the minimum number of shots of each basis
+        mitigator, optional (mitigation.ReadoutMitigator): see basis_deviations
+    returns:
+        dict: bases as keys and shots as values (accepted as shots by CountsBackend.run and CountsBackend.sweep)
+    """
+    if (total is None)==(target is None): raise ValueError('Exactly one of total and target must be given')
+    bases=tuple(bases)
+    sigma=basis_deviations(hamiltonian,bases,lookup,mitigator)
+    if target is not None: total=ceil(sigma.sum()**2/target**2)
+    spare=max(0,total-min_shots*len(bases))
+    weights=sigma/sigma.sum() if sigma.sum()>0 else full(len(bases),1/len(bases))
+    shots=floor(spare*weights)
+    #give the remaining shots to the bases with the largest remainders
+    for ix in argsort(shots-spare*weights)[:int(spare-shots.sum())]: shots[ix]+=1
+    return {basis:min_shots+int(n) for basis,n in zip(bases,shots)}
+
+def plan_shots(backend,circuit,hamiltonian,bases,lookup=None,total=None,target=None,pilot_shots=1024,parameters=None,seed=None,min_shots=100,mitigator=None):
+    """
+    Measure a circuit with a few shots in each basis, then allocate shots using the measured variances
+    arguments:
+        backend (CountsBackend): the backend to run on
+        circuit (qiskit.QuantumCircuit): the state preparation circuit (representative of the circuits to be measured, e.g. the shallowest of a sweep)
+        pilot_shots (int, default 1024): the number of shots of each basis in the pilot run
+        parameters, seed, optional: passed to CountsBackend.run
+        see allocate_shots for the other arguments
+    returns:
+        shots (dict): bases as keys and shots as values
+        pilot (tuple of PauliBasis): copies of bases with the results of the pilot run
+    """
+    pilot=backend.run(circuit,tuple(copy(basis) for basis in bases),pilot_shots,parameters,seed)
+    shots=allocate_shots(hamiltonian,pilot,lookup,total,target,min_shots,mitigator)
+    return {basis:shots[basis] for basis in bases},pilot
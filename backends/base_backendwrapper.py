@@ -1,11 +1,19 @@
 # quantum-computed-chemistry/backends.base_backendwrapper
 # A base class for backend wrappers, defines initialisation and methods related to checking for statevector capabilities and whether the backend is simulated
 
+#core
+from numbers import Integral
+from itertools import repeat
+
 #qiskit
 from qiskit import assemble
 
 #qcchem
 from .account import get_backend
+from . import instrument
+
+#Aer seeds experiment k of a job with seed_simulator+_SEED_STRIDE*k (seeds set on individual experiments are ignored), see BackendWrapper._submit
+_SEED_STRIDE=2113
 
 class BackendWrapper():
     """
@@ -15,54 +23,118 @@ class BackendWrapper():
         if isinstance(name,str): self.backend=get_backend(name)
         else: self.backend=name
     def __getattr__(self,attr):
-        if attr=='name':
-            try: return self.backend.custom_name
-            except AttributeError: return self.backend.name()
-        if attr=='n_qubits':
-            try: return len(self.backend.properties().qubits)
-            except AttributeError: return None
-        if attr=='connectivity':
-            try: gates=self.properties().gates
-            except AttributeError: return None
-            connectivity={}
-            for g in gates:
-                if len(g.qubits)==2:
-                    q0,q1=g.qubits
-                    if q0 in connectivity: connectivity[q0]+=(q1,)
-                    else: connectivity[q0]=(q1,)
-            return connectivity
+        if attr in ('name','n_qubits','connectivity'):
+            #backend metadata is computed once (properties may need a request to the provider)
+            metadata=self.__dict__.setdefault('_metadata',{})
+            if attr not in metadata: metadata[attr]=getattr(self,'_get_'+attr)()
+            return metadata[attr]
         if attr=='backend': return self.__getattribute__(attr)
         return getattr(self.backend,attr)
+    def _get_name(self):
+        try: return self.backend.custom_name
+        except AttributeError: return self.backend.name()
+    def _get_n_qubits(self):
+        try: return len(self._properties().qubits)
+        except AttributeError: return None
+    def _get_connectivity(self):
+        try: gates=self._properties().gates
+        except AttributeError: return None
+        connectivity={}
+        for g in gates:
+            if len(g.qubits)==2:
+                q0,q1=g.qubits
+                if q0 in connectivity: connectivity[q0]+=(q1,)
+                else: connectivity[q0]=(q1,)
+        return connectivity
+    def _properties(self):
+        """
+        The properties of the backend, retrieved once (None if the backend has no properties)
+        """
+        metadata=self.__dict__.setdefault('_metadata',{})
+        if 'properties' not in metadata:
+            try: metadata['properties']=self.backend.properties()
+            except AttributeError: metadata['properties']=None
+        return metadata['properties']
     @property
     def is_aer(self):
         return ('qasm_simulator' in self.backend.name() and not self.name=='ibmq_qasm_simulator') or self.is_statevector
     @property
+    def cache_key(self):
+        """
+        A hashable description of the backend, used to key cached transpilations
+        """
+        try: config=self.backend.configuration()
+        except AttributeError: return (self.name,)
+        return (self.name,tuple(config.basis_gates or ()),tuple(tuple(pair) for pair in (config.coupling_map or ())))
+    @property
     def is_statevector(self):
         return is_statevector(self.name)
     @property
     def is_noiseless(self):
         return self.is_statevector or self.name=='sim0'
-    def circuits2jobs(self,circuits,shots=8192):
+    def circuits2jobs(self,circuits,shots=8192,seed=None,max_experiments=None,max_shots=None,max_payload=None,lazy=False):
         """
         Batch (if required) and submit a set of circuits to the backend
         arguments:
-            circuits (iterable of qcchem.Circuit and/or qiskit.QuantumCircuit): the circuits to be submitted
-            shots (int, default 8192): the number of measurements to be taken in each basis
+            circuits (iterable of qcchem.Circuit and/or qiskit.QuantumCircuit): the circuits to be submitted, this may be a generator (it is consumed one job at a time)
+            shots (int or iterable of int, default 8192): the number of measurements to be taken in each basis, or the number for each circuit (in the same order as circuits)
+            seed, optional (int): the seed used by simulators
+            max_experiments, optional (int): the maximum number of circuits in each job (default is the limit of the backend, see BackendWrapper._chunk_size), e.g. to test batching on a local simulator
+            max_shots, optional (int): the maximum total number of shots in each job
+            max_payload, optional (int): the maximum total number of instructions in each job (a proxy for the size of the submitted qobj)
+            lazy (bool, default False): if True a generator is returned, which assembles and submits each job only when it is requested (see CountsBackend.stream)
         returns:
-            tuple of qiskit jobs: the jobs being run on the device
+            tuple of qiskit jobs (a generator if lazy): the jobs being run on the device
+        """
+        jobs=(self._submit(chunk,chunk_shots,seed,start) for chunk,chunk_shots,start in self._chunks(circuits,shots,max_experiments,max_shots,max_payload))
+        return jobs if lazy else tuple(jobs)
+    def _submit(self,circuits,shots,seed,start=0):
+        """
+        Assemble and submit a single job, shots is an int or a list with the number of shots for each circuit
+            start is the position of the first circuit in the whole batch, the seed of the job is offset so circuit i of the batch is simulated with seed seed+_SEED_STRIDE*i (as if the batch were a single job), whatever the chunking
+        """
+        options={} if seed is None else {'seed_simulator':seed+_SEED_STRIDE*start}
+        per_circuit=not isinstance(shots,Integral)
+        with instrument.stage('assemble',backend=self.name,circuits=len(circuits),shots=sum(shots) if per_circuit else shots*len(circuits)) as s:
+            # note that assemble won't accept a tuple of circuits it has to be a list
+            qobj=assemble(list(circuits),self.backend,shots=max(shots) if per_circuit else shots,**options)
+            #the shots of each experiment override the shots of the qobj
+            if per_circuit:
+                for experiment,n in zip(qobj.experiments,shots): experiment.config.shots=int(n)
+            if s: s.update(max_depth=max((circuit.depth() for circuit in circuits),default=0))
+        with instrument.stage('submit',backend=self.name,jobs=1):
+            return self.backend.run(qobj)
+    def _chunks(self,circuits,shots,max_experiments=None,max_shots=None,max_payload=None):
+        """
+        Split circuits (consumed lazily) into the (circuits,shots,start) submitted as each job, shots is an int or (if shots are given per circuit) a list, start is the position of the first circuit of the job in circuits
+        """
+        try: limit=self.backend.configuration().max_shots
+        except AttributeError: limit=None
+        per_circuit=not isinstance(shots,Integral)
+        if per_circuit and hasattr(shots,'__len__') and hasattr(circuits,'__len__') and len(shots)!=len(circuits):
+            raise ValueError(f'{len(shots)} shot counts were given for {len(circuits)} circuits')
+        if max_experiments is None: max_experiments=self._chunk_size(len(circuits) if hasattr(circuits,'__len__') else None)
+        chunk,chunk_shots,payload,total,start=[],[],0,0,0
+        for circuit,n in zip(circuits,shots if per_circuit else repeat(shots)):
+            if limit and n>limit: raise ValueError(f'{n} shots is more than the limit of {limit} for {self.name}')
+            size=len(circuit.data)
+            if len(chunk) and (len(chunk)>=max_experiments or (max_payload is not None and payload+size>max_payload) or (max_shots is not None and total+n>max_shots)):
+                yield chunk,(chunk_shots if per_circuit else shots),start
+                start+=len(chunk)
+                chunk,chunk_shots,payload,total=[],[],0,0
+            chunk.append(circuit)
+            chunk_shots.append(n)
+            payload+=size
+            total+=n
+        if len(chunk): yield chunk,(chunk_shots if per_circuit else shots),start
+    
+    def _chunk_size(self,n=None):
+        """
+        The number of circuits submitted in each job by circuits2jobs when n circuits are submitted (n is None if the number is not known in advance, e.g. for a generator)
         """
-        if self.is_aer: max_circs=len(circuits)
-        else:
-            try: max_circs=self.backend.configuration().max_experiments
-            except AttributeError: max_circs=300
-        chunked_circuits=[]
-        while len(circuits)>max_circs:
-            chunked_circuits.append(circuits[:max_circs])
-            circuits=circuits[max_circs:]
-        chunked_circuits.append(circuits)
-        qobjs=(assemble(list(circuit_chunk),self.backend,shots=shots) for circuit_chunk in chunked_circuits)
-        # note that assemble won't accept a tuple of circuits it has to be a list
-        return tuple(self.backend.run(qobj) for qobj in qobjs)
+        if self.is_aer: return max(n,1) if n is not None else 300
+        try: return self.backend.configuration().max_experiments
+        except AttributeError: return 300
     
 def is_statevector(name):
     return name in ('statevector_simulator','vec')
@@ -0,0 +1,89 @@
+# quantum-computed-chemistry/backends/cache.py
+# In-memory caches shared by the backend wrappers
+
+#core
+from collections import OrderedDict
+
+#qiskit
+from qiskit.circuit import ParameterExpression
+
+class LRUCache():
+    """
+    A dictionary-like cache which evicts the least recently used entry once maxsize entries are stored
+        main methods:
+            LRUCache.get
+            LRUCache.clear
+            LRUCache.info
+    """
+    def __init__(self,maxsize=128):
+        self.maxsize=maxsize
+        self._data=OrderedDict()
+        self.hits=0
+        self.misses=0
+    def get(self,key,default=None):
+        """
+        Retrieve an entry (marking it as recently used) and record a hit or a miss
+        arguments:
+            key (hashable): the key of the entry
+            default (any, default None): returned if the key is not in the cache
+        returns:
+            the cached value or default
+        """
+        try: value=self._data[key]
+        except KeyError:
+            self.misses+=1
+            return default
+        self._data.move_to_end(key)
+        self.hits+=1
+        return value
+    def __setitem__(self,key,value):
+        self._data[key]=value
+        self._data.move_to_end(key)
+        while len(self._data)>self.maxsize: self._data.popitem(last=False)
+    def __getitem__(self,key):
+        value=self.get(key,_MISSING)
+        if value is _MISSING: raise KeyError(key)
+        return value
+    def __contains__(self,key):
+        return key in self._data
+    def __len__(self):
+        return len(self._data)
+    def clear(self):
+        """
+        Remove all entries and reset the statistics
+        """
+        self._data.clear()
+        self.hits=0
+        self.misses=0
+    def info(self):
+        """
+        returns:
+            dict: the number of hits and misses, and the current and maximum size of the cache
+        """
+        return {'hits':self.hits,'misses':self.misses,'size':len(self._data),'maxsize':self.maxsize}
+
+_MISSING=object()
+
+#transpiled measurement circuits, keyed by backend, circuit structure and basis (see CountsBackend.circ2circuits)
+TRANSPILE_CACHE=LRUCache(maxsize=512)
+
+def circuit_key(circuit):
+    """
+    A hashable description of the structure of a circuit, parameters are included by identity (not name) so parameterised circuits share a key for all values, but circuits with distinct Parameter objects of the same name do not (a cached template can only be bound with its own parameters)
+    arguments:
+        circuit (qiskit.QuantumCircuit): the circuit
+    returns:
+        tuple
+    """
+    qubits={q:i for i,q in enumerate(circuit.qubits)}
+    clbits={c:i for i,c in enumerate(circuit.clbits)}
+    return (circuit.num_qubits,circuit.num_clbits)+tuple(
+        (inst.name,tuple(_param_key(p) for p in inst.params),tuple(qubits[q] for q in qargs),tuple(clbits[c] for c in cargs))
+        for inst,qargs,cargs in circuit.data)
+
+def _param_key(param):
+    """
+    The key of an instruction parameter, expressions also include the Parameter objects they depend on (which compare by name and uuid)
+    """
+    if isinstance(param,ParameterExpression): return (str(param),frozenset(param.parameters))
+    return str(param)
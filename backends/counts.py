@@ -0,0 +1,179 @@
+# quantum-computed-chemistry/backends/counts.py
+# A compact, dictionary compatible container of measurement counts (integer encoded outcomes and an array of frequencies)
+
+#core
+from struct import pack,unpack,calcsize
+
+#numpy
+from numpy import array,asarray,frombuffer,fromiter,packbits,unpackbits,unique,bincount,memmap,zeros,uint8,uint64,int64
+
+#file header: magic, width, number of outcomes, number of words per outcome, number of register separators
+_HEADER='<4sIIII'
+_MAGIC=b'QCC1'
+
+class Counts(dict):
+    """
+    Measurement counts stored as arrays, and as a dictionary of bitstrings and frequencies (a dict subclass like qiskit's Counts, so it can be passed to anything expecting the result of Result.get_counts, e.g. json.dumps or plot_histogram)
+        character i of a bitstring (ignoring register separators) is bit i of the outcome, so for circuits measured by PauliBasis.apply it corresponds to qubit i
+        the dictionary is filled from the arrays when the counts are created, it should be treated as read-only (changes are not reflected in the arrays used by the estimator functions)
+    attributes:
+        outcomes (numpy.ndarray of uint64, shape (n_outcomes,n_words)): the outcomes packed into 64 bit words, the first character of the bitstring is the most significant bit of the first word (see estimator.counts2arrays)
+        counts (numpy.ndarray of int64, shape (n_outcomes,)): the frequency of each outcome
+        width (int): the number of bits in each outcome
+        spaces (tuple of int): the positions of the register separators in the bitstrings
+    main methods:
+        Counts.from_dict
+        Counts.from_result
+        Counts.marginal
+        Counts.save
+        Counts.load
+    """
+    __slots__=('outcomes','counts','width','spaces')
+    def __init__(self,outcomes,counts,width,spaces=()):
+        self.outcomes=outcomes
+        self.counts=counts
+        self.width=width
+        self.spaces=tuple(spaces)
+        super().__init__(zip(self._keys(),asarray(counts).tolist()))
+    @classmethod
+    def from_dict(cls,counts):
+        """
+        arguments:
+            counts (dict): bitstrings as keys and frequencies as values
+        """
+        if isinstance(counts,Counts): return counts
+        keys=list(counts)
+        if not len(keys): raise ValueError('Cannot store an empty set of counts')
+        spaces=[i for i,c in enumerate(keys[0]) if c==' ']
+        if len(spaces): keys=[k.replace(' ','') for k in keys]
+        width=len(keys[0])
+        bits=frombuffer(''.join(keys).encode(),dtype=uint8).reshape(len(keys),width)-ord('0')
+        return cls(_pack(bits),fromiter(counts.values(),dtype=int64,count=len(keys)),width,spaces)
+    @classmethod
+    def from_result(cls,result):
+        """
+        Convert the counts of every experiment in a qiskit result directly from the (hexadecimal) counts returned by the backend, without building bitstrings
+        arguments:
+            result (qiskit.result.Result)
+        returns:
+            list of Counts: one per experiment
+        """
+        out=[]
+        for ix,experiment in enumerate(result.results):
+            counts=getattr(experiment.data,'counts',None)
+            if counts is None:
+                #let qiskit handle (or raise an error for) results without hexadecimal counts
+                out.append(cls.from_dict(result.get_counts(ix)))
+                continue
+            header=experiment.header
+            sizes=[size for _,size in getattr(header,'creg_sizes',None) or []]
+            width=getattr(header,'memory_slots',None) or sum(sizes)
+            spaces,position=[],0
+            for size in sizes[::-1][:-1]:
+                position+=size
+                spaces.append(position)
+                position+=1
+            n_words=max(1,-(-width//64))
+            if n_words==1: outcomes=fromiter((int(k,16) for k in counts),dtype=uint64,count=len(counts))[:,None]
+            else:
+                values=[int(k,16) for k in counts]
+                outcomes=array([[v>>64*(n_words-1-w)&(2**64-1) for w in range(n_words)] for v in values],dtype=uint64).reshape(len(values),n_words)
+            out.append(cls(outcomes,fromiter(counts.values(),dtype=int64,count=len(counts)),width,spaces))
+        return out
+    @property
+    def shots(self):
+        return int(self.counts.sum())
+    def __repr__(self):
+        return f'Counts({dict(self)})'
+    def to_dict(self):
+        return dict(self.items())
+    def bits(self):
+        """
+        returns:
+            numpy.ndarray of uint8, shape (n_outcomes,width): the bits of each outcome (column i is character i of the bitstrings)
+        """
+        return _unpack(self.outcomes,self.width)
+    def marginal(self,qubits):
+        """
+        The counts of a subset of the bits (e.g. to evaluate operators acting on a few qubits)
+        arguments:
+            qubits (iterable of int): the characters of the bitstrings (ignoring separators) to keep, in the order they appear in the marginal bitstrings
+        returns:
+            Counts: frequencies of the distinct outcomes of the chosen bits
+        """
+        qubits=list(qubits)
+        outcomes,inverse=unique(_pack(self.bits()[:,qubits]),axis=0,return_inverse=True)
+        return Counts(outcomes,bincount(inverse.ravel(),weights=self.counts,minlength=len(outcomes)).astype(int64),len(qubits))
+    def tobytes(self):
+        """
+        Pack the counts into bytes: header, separator positions, outcomes (64 bit words) and frequencies
+        """
+        header=pack(_HEADER,_MAGIC,self.width,len(self.counts),self.outcomes.shape[1],len(self.spaces))
+        return header+pack(f'<{len(self.spaces)}I',*self.spaces)+asarray(self.outcomes).astype('<u8').tobytes()+asarray(self.counts).astype('<u8').tobytes()
+    @classmethod
+    def frombytes(cls,data):
+        """
+        Unpack bytes written by Counts.tobytes
+        """
+        width,n,n_words,spaces,start=_header(data)
+        outcomes=frombuffer(data,dtype='<u8',count=n*n_words,offset=start).reshape(n,n_words).astype(uint64)
+        counts=frombuffer(data,dtype='<u8',count=n,offset=start+8*n*n_words).astype(int64)
+        return cls(outcomes,counts,width,spaces)
+    def save(self,path):
+        """
+        Write the counts to a file (see Counts.load)
+        """
+        with open(path,'wb') as f: f.write(self.tobytes())
+    @classmethod
+    def load(cls,path,mmap=True):
+        """
+        Read counts written by Counts.save
+        arguments:
+            path (str): the file
+            mmap (bool, default True): whether to memory map the outcomes and frequencies rather than reading them into memory (for large sweeps)
+        """
+        if not mmap:
+            with open(path,'rb') as f: return cls.frombytes(f.read())
+        with open(path,'rb') as f: data=f.read(calcsize(_HEADER)+4*2**10)
+        width,n,n_words,spaces,start=_header(data)
+        outcomes=memmap(path,dtype='<u8',mode='r',offset=start,shape=(n,n_words))
+        counts=memmap(path,dtype='<u8',mode='r',offset=start+8*n*n_words,shape=(n,))
+        return cls(outcomes,counts,width,spaces)
+    def _keys(self):
+        """
+        The bitstrings of the outcomes, in the order of Counts.counts
+        """
+        keys=(self.bits()+ord('0')).astype(uint8).tobytes().decode()
+        w=self.width
+        keys=[keys[i*w:(i+1)*w] for i in range(len(self.counts))]
+        for position in self.spaces: keys=[k[:position]+' '+k[position:] for k in keys]
+        return keys
+
+def _header(data):
+    """
+    Read the header written by Counts.tobytes
+    returns:
+        width, number of outcomes, number of words, separator positions, offset of the outcomes
+    """
+    start=calcsize(_HEADER)
+    magic,width,n,n_words,n_spaces=unpack(_HEADER,data[:start])
+    if magic!=_MAGIC: raise ValueError('Not a packed set of counts')
+    spaces=unpack(f'<{n_spaces}I',data[start:start+4*n_spaces])
+    return width,n,n_words,spaces,start+4*n_spaces
+
+def _pack(bits):
+    """
+    Pack an array of bits (n,width) into 64 bit words (n,n_words), padding on the left
+    """
+    n,width=bits.shape
+    n_words=max(1,-(-width//64))
+    padded=zeros((n,64*n_words),dtype=uint8)
+    padded[:,64*n_words-width:]=bits
+    return packbits(padded,axis=1).view('>u8').astype(uint64)
+
+def _unpack(words,width):
+    """
+    Unpack 64 bit words (n,n_words) into an array of bits (n,width), the inverse of _pack
+    """
+    n_words=words.shape[1]
+    return unpackbits(asarray(words).astype('>u8').view(uint8),axis=1)[:,64*n_words-width:]
@@ -3,12 +3,18 @@
 
 #core
 from time import sleep
+from copy import copy
+from numbers import Integral
 
 #qiskit
-from qiskit import transpile,ClassicalRegister
+from qiskit import transpile,ClassicalRegister,QuantumCircuit
 
 #qcchem
 from .base_backendwrapper import BackendWrapper
+from .cache import TRANSPILE_CACHE,circuit_key
+from .resultcache import ResultCache,backend_fingerprint
+from .counts import Counts
+from . import instrument
 
 
 class CountsBackend(BackendWrapper):
@@ -16,44 +22,172 @@ class CountsBackend(BackendWrapper):
     A class to wrap backends that return measurement counts (as opposed to a statevector)
         main methods:
             CountsBackend.run
+            CountsBackend.sweep
             CountsBackend.circ2circuits
             CountsBackend.circuits2jobs
             CountsBackend.jobs2counts
+            CountsBackend.iter_counts
+            CountsBackend.stream
     """
-    
-    def circ2circuits(self,circuit,bases):
+    def __init__(self,name,cache=None):
+        """
+        arguments:
+            name (str or qiskit backend): the backend to wrap, see account.get_backend for allowed names
+            cache, optional (str or ResultCache): a persistent cache of counts (or the directory in which to store it), if provided seeded runs and sweeps serve previously measured circuits from the cache instead of executing them (unseeded runs are always executed, so repeated measurements are independent)
+        """
+        super().__init__(name)
+        self.cache=ResultCache(cache) if isinstance(cache,str) else cache
+    def circ2circuits(self,circuit,bases,parameters=None):
         """
         Apply a set of measurements to a base circuit
+            NB. transpiled circuits are cached (see cache.TRANSPILE_CACHE) by backend, circuit structure and basis, so a parameterised circuit is only transpiled once and later calls only bind the parameters
+            NB. circuits which are already transpiled (marked by metadata['transpiled'], e.g. from extrapolation.circuits.RepeatedCircuit) are not transpiled again, only a cached transpiled measurement is appended, element i of each basis is measured on physical qubit metadata['layout'][i] (default is the trivial layout)
         arguments:
             circuit (qcchem.Circuit or qiskit.QuantumCircuit): the state preparation circuit to be measured
             bases (iterable of qcchem.measurement.PauliBasis and/or qcchem.measurement.FermionicBasis): the bases in which the prepared state should be measured
+            parameters, optional (dict or sequence): values to bind to the parameters of circuit (passed to QuantumCircuit.assign_parameters)
         returns:
             tuple of circuits (matching the type of input circuit): the complete circuits to be run on the backend, if bases is ordered (e.g. tuple or list as opposed to set) the order of the output circuits will match the order of the input bases
         """
         if len(circuit.clbits)==0: circuit.add_classicalregister()
-        circuit=transpile(circuit,self.backend)
-        return tuple(transpile(basis.apply(circuit.copy()),self.backend) for basis in bases)
-    def jobs2counts(self,jobs,bases=None):
+        with instrument.stage('transpile',backend=self.name) as s:
+            if (circuit.metadata or {}).get('transpiled'):
+                if parameters is not None: circuit=circuit.assign_parameters(parameters)
+                measurements=[self._measurement(circuit,basis) for basis in bases]
+                circuits=tuple(circuit.compose(measurement,qubits=range(measurement.num_qubits),clbits=range(circuit.num_clbits)) for measurement in measurements)
+                transpiled=0
+            else:
+                key=(self.cache_key,circuit_key(circuit))
+                prepared=None
+                circuits=()
+                transpiled=0
+                for basis in bases:
+                    template=TRANSPILE_CACHE.get(key+(basis,))
+                    if template is None:
+                        if prepared is None: prepared=transpile(circuit,self.backend)
+                        template=transpile(basis.apply(prepared.copy()),self.backend)
+                        TRANSPILE_CACHE[key+(basis,)]=template
+                        transpiled+=1
+                    circuits+=(template.copy() if parameters is None else template.assign_parameters(parameters),)
+            if s: s.update(circuits=len(circuits),transpiled=transpiled,max_depth=max((c.depth() for c in circuits),default=0))
+        return circuits
+    def _measurement(self,circuit,basis):
         """
-        Retrieve the results for a previously submitted batch of jobs
+        The transpiled basis rotation and measurement for an already transpiled circuit, acting on the physical qubits of its layout (metadata['layout'], default is the trivial layout), cached by backend, layout, number of clbits and basis
+        """
+        layout=tuple((circuit.metadata or {}).get('layout') or range(circuit.num_qubits))
+        key=(self.cache_key,'measurement',layout,circuit.num_clbits,basis)
+        measurement=TRANSPILE_CACHE.get(key)
+        if measurement is None:
+            measurement=transpile(basis.apply(QuantumCircuit(len(layout),circuit.num_clbits)),self.backend,initial_layout=list(layout))
+            TRANSPILE_CACHE[key]=measurement
+        return measurement
+    def jobs2counts(self,jobs,bases=None,max_in_flight=None):
+        """
+        Retrieve the results for a previously submitted batch of jobs (blocking until every job has finished)
+        see also:
+            CountsBackend.iter_counts
         arguments:
-            jobs (iterable of qiskit jobs and/or str): the jobs for which results should be retrieved, if given as strings, they are assumed to be job IDs for jobs run on this device
+            jobs (iterable of qiskit jobs and/or str): the jobs for which results should be retrieved, if given as strings, they are assumed to be job IDs for jobs run on this device, this may be a lazy generator of jobs (see BackendWrapper.circuits2jobs)
             bases, optional (iterable of qcchem.measurement.PauliBasis and/or qcchem.measurement.FermionicBasis): the bases being measured in each circuit if provided, these are used to modify the counts to remove any non-locality in fermionic measurements
+            max_in_flight, optional (int): if jobs is a lazy generator, the maximum number of jobs submitted but not yet retrieved
         returns:
             bases, if bases is provided (the same object containing the same bases): the results can be retrieved using bases[ix].results
-            results, if bases is not provided (tuple of dictionaries): each dictionary has bitstrings as keys and frequencies as values, the dictionaries are in the order the circuits were initially submitted
+            results, if bases is not provided (tuple of Counts): dictionary-like, with bitstrings as keys and frequencies as values, in the order the circuits were initially submitted
         """
-        results=()
-        if isinstance(jobs[0],str): jobs=[self.retrieve_job(job) for job in jobs]
-        for job in jobs:
-            while not job.in_final_state(): sleep(5)
-            results+=(job.result().get_counts(),)
-        results=(r for res in results for r in (res if isinstance(res,list) else [res,]))
+        by_job=dict(self._iter_results(jobs,max_in_flight=max_in_flight))
+        results=(r for ix in sorted(by_job) for r in by_job[ix])
         if bases is None: return tuple(results)
         for basis,res in zip(bases,results):
             basis.results=res
         return bases
-    def run(self,circuit,bases='def',shots=8192):
+    def iter_counts(self,jobs,bases=None,sizes=None,interval=0.001,max_interval=5):
+        """
+        Retrieve the results for a previously submitted batch of jobs as each job finishes, so that results can be processed while later jobs are still running
+        arguments:
+            jobs (iterable of qiskit jobs and/or str): the jobs for which results should be retrieved, if given as strings, they are assumed to be job IDs for jobs run on this device
+            bases, optional (iterable of qcchem.measurement.PauliBasis and/or qcchem.measurement.FermionicBasis): the bases being measured in each circuit, in the order the circuits were submitted
+            sizes, optional (iterable of int): the number of circuits in each job, if not provided these are inferred from the number of bases using the default chunking of circuits2jobs (so sizes must be given if jobs were split with max_experiments, max_shots or max_payload, otherwise ValueError is raised)
+            interval (float, default 0.001): the initial time (in seconds) between polls of the outstanding jobs, this doubles each time no job has finished
+            max_interval (float, default 5): the maximum time between polls
+        yields:
+            (basis,counts) if bases is provided: the results are also assigned to basis.results
+            (ix,counts) if bases is not provided: ix is the position of the circuit in the submitted batch
+        """
+        if isinstance(jobs[0],str): jobs=[self.retrieve_job(job) for job in jobs]
+        if bases is not None: bases=tuple(bases)
+        inferred=sizes is None
+        if inferred:
+            if len(jobs)>1 and bases is None: raise ValueError('Either bases or sizes must be provided to order the results of several jobs')
+            chunk=self._chunk_size(len(bases)) if bases is not None else 0
+            sizes=[chunk]*(len(jobs)-1)
+            if bases is not None: sizes.append(len(bases)-sum(sizes))
+            if bases is not None and (sizes[-1]<=0 or sizes[-1]>chunk): raise ValueError(f'{len(jobs)} jobs do not match the default chunking of {len(bases)} circuits, provide the sizes of the jobs (e.g. if circuits2jobs was called with max_experiments, max_shots or max_payload)')
+        offsets=[0]
+        for size in sizes: offsets.append(offsets[-1]+size)
+        for ix,results in self._iter_results(jobs,interval,max_interval):
+            if inferred and bases is not None and len(results)!=sizes[ix]: raise ValueError(f'Job {ix} has {len(results)} circuits but {sizes[ix]} were inferred from the default chunking, provide the sizes of the jobs (e.g. if circuits2jobs was called with max_experiments, max_shots or max_payload)')
+            for jx,res in enumerate(results,offsets[ix]):
+                if bases is None: yield jx,res
+                else:
+                    bases[jx].results=res
+                    yield bases[jx],res
+    def stream(self,circuits,bases=None,shots=8192,seed=None,max_in_flight=4,max_experiments=None,max_shots=None,max_payload=None,interval=0.001,max_interval=5):
+        """
+        Submit circuits lazily, keeping at most max_in_flight jobs running, and yield the results as each job finishes, so very large sweeps run in bounded memory (and without flooding remote queues)
+        see also:
+            CountsBackend.circuits2jobs
+            CountsBackend.iter_counts
+        arguments:
+            circuits (iterable of qiskit.QuantumCircuit): the complete circuits (e.g. from CountsBackend.circ2circuits), this may be a generator, it is consumed one job at a time
+            bases, optional (sequence of qcchem.measurement.PauliBasis): the basis measured by each circuit, in the same order as circuits
+            shots (int or iterable of int, default 8192): the number of measurements to be taken in each basis, or the number for each circuit
+            seed, optional (int): the seed used by simulators
+            max_in_flight (int, default 4): the maximum number of jobs submitted but not yet retrieved
+            max_experiments, max_shots, max_payload, optional (int): limits on the size of each job (see BackendWrapper.circuits2jobs)
+            interval, max_interval (float): the polling interval (see CountsBackend.iter_counts)
+        yields:
+            (basis,counts) if bases is provided: the results are also assigned to basis.results
+            (ix,counts) if bases is not provided: ix is the position of the circuit in circuits
+        """
+        offsets=[0]
+        def submit():
+            for chunk,chunk_shots,start in self._chunks(circuits,shots,max_experiments,max_shots,max_payload):
+                offsets.append(start+len(chunk))
+                yield self._submit(chunk,chunk_shots,seed,start)
+        for ix,results in self._iter_results(submit(),interval,max_interval,max_in_flight):
+            for jx,res in enumerate(results,offsets[ix]):
+                if bases is None: yield jx,res
+                else:
+                    bases[jx].results=res
+                    yield bases[jx],res
+    def _iter_results(self,jobs,interval=0.001,max_interval=5,max_in_flight=None):
+        """
+        Poll all outstanding jobs (with exponential backoff) and yield (job index, list of Counts) as each job finishes
+            jobs may be a generator which submits each job as it is requested (see BackendWrapper.circuits2jobs), in which case at most max_in_flight jobs are requested before earlier ones finish
+        """
+        if isinstance(jobs,(list,tuple)) and len(jobs) and isinstance(jobs[0],str): jobs=[self.retrieve_job(job) for job in jobs]
+        jobs=enumerate(jobs)
+        pending={}
+        wait=interval
+        while True:
+            while max_in_flight is None or len(pending)<max_in_flight:
+                try: ix,job=next(jobs)
+                except StopIteration: break
+                pending[ix]=job
+            if not len(pending): return
+            finished=[ix for ix,job in pending.items() if job.in_final_state()]
+            if not len(finished):
+                with instrument.stage('wait',backend=self.name,max_pending=len(pending)): sleep(wait)
+                wait=min(2*wait,max_interval)
+                continue
+            wait=interval
+            for ix in finished:
+                with instrument.stage('parse',backend=self.name) as s:
+                    res=Counts.from_result(pending.pop(ix).result())
+                    if s: s.update(circuits=len(res),shots=sum(counts.shots for counts in res))
+                yield ix,res
+    def run(self,circuit,bases='def',shots=8192,parameters=None,seed=None):
         """
         Convert a state preparation circuit to counts in a given set of measurement bases
         see also:
@@ -63,28 +197,118 @@ class CountsBackend(BackendWrapper):
         arguments:
             circuit (qcchem.Circuit or qiskit.QuantumCircuit): the state preparation circuit to be measured
             bases (iterable of qcchem.measurement.PauliBasis and/or qcchem.measurement.FermionicBasis): the bases in which the prepared state should be measured
-            shots (int, default 8192): the number of measurements to be taken in each basis
+            shots (int, sequence of int or dict, default 8192): the number of measurements to be taken in each basis, a sequence gives the shots of each basis (in the order of bases) and a dict maps bases to shots (see allocation.allocate_shots)
+            parameters, optional (dict or sequence): values to bind to the parameters of circuit
+            seed, optional (int): the seed used by simulators
         returns:
             bases (same as input): the results can be retrieved using bases[ix].results
         """
-        if isinstance(circuit,(list,tuple)): return type(circuit)(self.run(circ,bases,shots) for circ in circuit)
+        if isinstance(circuit,(list,tuple)): return type(circuit)(self.run(circ,bases,shots,parameters,seed) for circ in circuit)
         if bases=='def': bases=[PauliBasis('Z'*circuit.num_qubits)]
         elif bases is None: bases=[PauliBasis('I'*circuit.num_qubits)]
-        return self.jobs2counts(self.circuits2jobs(self.circ2circuits(circuit,bases),shots),bases)
+        shots=_basis_shots(shots,bases)
+        if self.cache is None or seed is None: return self.jobs2counts(self.circuits2jobs(self.circ2circuits(circuit,bases,parameters),shots,seed),bases)
+        for basis,res in zip(bases,self._cached_counts(self.circ2circuits(circuit,bases,parameters),bases,shots,seed)):
+            basis.results=res
+        return bases
+    def sweep(self,experiments,bases,shots=8192,seed=None,max_in_flight=None):
+        """
+        Measure many state preparation circuits, submitting every circuit together so they are batched into as few jobs as possible
+        see also:
+            CountsBackend.run
+        arguments:
+            experiments (dict): keys label each experiment (e.g. (point,depth,repeat)), values are state preparation circuits or (circuit,parameters) tuples
+            bases (iterable of qcchem.measurement.PauliBasis and/or qcchem.measurement.FermionicBasis): the bases in which each prepared state should be measured
+            shots (int, sequence of int or dict, default 8192): the number of measurements to be taken in each basis (see CountsBackend.run), the same for every experiment
+            seed, optional (int): the seed used by simulators
+            max_in_flight, optional (int): if provided (and the results are not cached), circuits are built and submitted lazily with at most max_in_flight jobs running at once (see CountsBackend.stream)
+        returns:
+            dict: the same keys as experiments, values are tuples of copies of bases, the results can be retrieved using results[key][ix].results
+        """
+        bases=tuple(bases)
+        shots=_basis_shots(shots,bases)
+        if not isinstance(shots,Integral): shots=shots*len(experiments)
+        def build():
+            for experiment in experiments.values():
+                circuit,parameters=experiment if isinstance(experiment,tuple) else (experiment,None)
+                yield from self.circ2circuits(circuit,bases,parameters)
+        if self.cache is not None and seed is not None: results=iter(self._cached_counts(list(build()),bases*len(experiments),shots,seed))
+        elif max_in_flight is None: results=iter(self.jobs2counts(self.circuits2jobs(list(build()),shots,seed)))
+        else:
+            by_circuit=dict(self.stream(build(),shots=shots,seed=seed,max_in_flight=max_in_flight))
+            results=(by_circuit.pop(ix) for ix in range(len(by_circuit)))
+        out={}
+        for key in experiments:
+            out[key]=tuple(copy(basis) for basis in bases)
+            for basis in out[key]: basis.results=next(results)
+        return out
+    def _cached_counts(self,circuits,bases,shots,seed):
+        """
+        Retrieve the counts for a set of measurement circuits from the cache, executing (and caching) only those that are missing
+            repeats of the same circuit are numbered (see ResultCache.key) so each has its own entry
+        """
+        fingerprint=backend_fingerprint(self)
+        per_circuit=shots if not isinstance(shots,Integral) else [shots]*len(circuits)
+        keys,seen=[],{}
+        for circuit,basis,n in zip(circuits,bases,per_circuit):
+            key=self.cache.key(circuit,basis,n,seed,fingerprint)
+            occurrence=seen[key]=seen.get(key,-1)+1
+            keys.append(key if not occurrence else self.cache.key(circuit,basis,n,seed,fingerprint,occurrence))
+        results=[self.cache.get(key) for key in keys]
+        missing=[ix for ix,res in enumerate(results) if res is None]
+        if len(missing):
+            missing_shots=shots if isinstance(shots,Integral) else [shots[ix] for ix in missing]
+            for ix,res in zip(missing,self.jobs2counts(self.circuits2jobs([circuits[ix] for ix in missing],missing_shots,seed))):
+                self.cache.put(keys[ix],res)
+                results[ix]=res
+        return results
     
-from itertools import zip_longest
+def _basis_shots(shots,bases):
+    """
+    The number of shots for each basis: an int (the same for every basis) or a list in the order of bases
+    """
+    if isinstance(shots,Integral): return shots
+    if isinstance(shots,dict): return [shots[basis] for basis in bases]
+    shots=list(shots)
+    if len(shots)!=len(bases): raise ValueError(f'{len(shots)} shot counts were given for {len(bases)} bases')
+    return shots
+
+#translation tables used to convert Pauli strings to (reversed) x and z bitmasks
+_X=str.maketrans('IXYZ','0110')
+_Z=str.maketrans('IXYZ','0011')
 
 class CommutationError(Exception):
     pass
 
 class PauliBasis():
+    """
+    A Pauli measurement basis, stored as x and z bitmasks (bit i corresponds to the element acting on qubit i)
+    """
+    __slots__=('_x','_z','_n','_hash','_res')
     def __init__(self,elements):
-        self.basis=elements
+        if isinstance(elements,PauliBasis): x,z,n=elements._x,elements._z,elements._n
+        else: x,z,n=_masks(elements)
+        self._set(x,z,n)
+    @classmethod
+    def from_masks(cls,x,z,n):
+        """
+        Create a basis directly from its bitmasks
+        arguments:
+            x (int): bit i is set if the element acting on qubit i is X or Y
+            z (int): bit i is set if the element acting on qubit i is Z or Y
+            n (int): the number of qubits
+        """
+        basis=cls.__new__(cls)
+        basis._set(x,z,n)
+        return basis
+    def _set(self,x,z,n):
+        self._x,self._z,self._n=x,z,n
+        #hash the string so that bases can be used interchangeably with their string as dictionary keys
+        self._hash=hash(self.basis)
     def apply(self,circuit,barriers=False):
-        if self.active is None: self.initialise()
         self._apply(circuit,barriers)
         if not len(circuit.clbits): circuit.add_classicalregister()
-        active=sorted(self.active)
+        active=self.active
         circuit.measure(active,[len(circuit.clbits)-i-1 for i in active])
         return circuit
     def __lt__(self,other):
@@ -96,24 +320,40 @@ class PauliBasis():
         except AttributeError: pass
         return self.basis>other
     def __eq__(self,other):
-        try: other=other.basis
-        except AttributeError: pass
+        if isinstance(other,PauliBasis): return (self._x,self._z,self._n)==(other._x,other._z,other._n)
         return self.basis==other
     def __hash__(self):
-        return hash(self.basis)
+        return self._hash
     def __len__(self):
-        return len(self.basis)
+        return self._n
     def contains(self,other):
-        try: diff=self.difference(other,check=False)
-        except CommutationError: return False
-        return not diff
+        x,z,n=_masks(other)
+        support=self._x|self._z
+        return not ((x|z)&~support or ((self._x^x)|(self._z^z))&(x|z))
+    def commutes(self,other):
+        """
+        Check whether two bases qubit-wise commute (i.e. can be measured simultaneously)
+        """
+        x,z,n=_masks(other)
+        return not ((self._x^x)|(self._z^z))&(self._x|self._z)&(x|z)
+    def union(self,other):
+        """
+        Return the smallest basis that contains both bases, raises CommutationError if they do not qubit-wise commute
+        """
+        x,z,n=_masks(other)
+        if ((self._x^x)|(self._z^z))&(self._x|self._z)&(x|z): raise CommutationError('The operators do not commute')
+        return PauliBasis.from_masks(self._x|x,self._z|z,max(self._n,n))
     @property
     def basis(self):
-        return self._basis
-    @basis.setter
-    def basis(self,basis):
-        self._basis=basis.upper()
-        self.active=None
+        x,z,n=self._x,self._z,self._n
+        return ''.join('IXZY'[(x>>i&1)|(z>>i&1)<<1] for i in range(n))
+    @property
+    def masks(self):
+        return self._x,self._z
+    @property
+    def active(self):
+        support=self._x|self._z
+        return [i for i in range(support.bit_length()) if support>>i&1]
     @property
     def results(self):
         try: return self._res
@@ -121,28 +361,27 @@ class PauliBasis():
     @results.setter
     def results(self,counts):
         self._res=counts
-    def initialise(self):
-        self.active=[i for i,P in enumerate(self.basis) if not P=='I']
     def _apply(self,circuit,barriers=False):
         if barriers: circuit.barrier()
         for j,P in enumerate(self.basis):
             if P in 'IZ': continue
             if P=='Y': circuit.sdg(j)
-            if P in 'XY':
-                circuit.h(j)
-                continue
-            raise KeyError(f'Unknown Pauli operator {P}')
+            circuit.h(j)
         return circuit
     def __str__(self):
         return 'Basis('+str(self.basis)+')'
     def difference(self,other,check=True):
-        try: other=other.basis
-        except AttributeError: pass
-        diff=0
-        for p1,p2 in zip_longest(self.basis,other,fillvalue='I'):
-            if p2 in (p1,'I'): continue
-            if p1=='I':
-                diff+=1
-                continue
-            raise CommutationError('The operators do not commute')
-        return diff
+        x,z,n=_masks(other)
+        support=self._x|self._z
+        if ((self._x^x)|(self._z^z))&support&(x|z): raise CommutationError('The operators do not commute')
+        return bin((x|z)&~support).count('1')
+
+def _masks(pauli):
+    """
+    Convert a Pauli string (or PauliBasis) to its x and z bitmasks and length
+    """
+    if isinstance(pauli,PauliBasis): return pauli._x,pauli._z,pauli._n
+    pauli=pauli.upper()
+    if not len(pauli): return 0,0,0
+    if pauli.strip('IXYZ'): raise KeyError(f'Unknown Pauli operator in {pauli}')
+    return int(pauli.translate(_X)[::-1],2),int(pauli.translate(_Z)[::-1],2),len(pauli)
@@ -0,0 +1,170 @@
+# quantum-computed-chemistry/backends/estimator.py
+# Vectorised evaluation of Pauli expectation values (and their shot noise) from measurement counts
+
+#numpy
+from numpy import asarray,frombuffer,zeros,uint8,uint64,bitwise_xor,concatenate
+from numpy.random import default_rng
+
+#qcchem
+from . import instrument
+from .counts import Counts,_pack
+
+#maximum number of (term,outcome) pairs evaluated at once, bounds the memory used by parities
+_BLOCK=1<<22
+
+def counts2arrays(counts):
+    """
+    Convert a counts dictionary to arrays of integer outcomes and weights
+    arguments:
+        counts (dict or Counts): bitstrings as keys and frequencies as values (as returned by CountsBackend.jobs2counts)
+    returns:
+        outcomes (numpy.ndarray of uint64, shape (n_outcomes,n_words)): the outcomes packed into 64 bit words, the first character of the bitstring is the most significant bit of the first word
+        weights (numpy.ndarray of float): the frequency of each outcome
+        width (int): the number of bits in each outcome
+    """
+    counts=Counts.from_dict(counts)
+    return asarray(counts.outcomes,dtype=uint64),asarray(counts.counts,dtype=float),counts.width
+
+def pauli_masks(paulis,width):
+    """
+    Convert Pauli strings to bitmasks matching the outcomes returned by counts2arrays
+    arguments:
+        paulis (iterable of str): the Pauli strings, these are padded with (or truncated to) identities to match width
+        width (int): the number of bits in each outcome
+    returns:
+        masks (numpy.ndarray of uint64, shape (n_paulis,n_words)): the masks of the non-identity elements of each Pauli string
+    """
+    paulis=[str(getattr(p,'basis',p)).upper()[:width].ljust(width,'I') for p in paulis]
+    bits=(frombuffer(''.join(paulis).encode(),dtype=uint8)!=ord('I')).reshape(len(paulis),width)
+    return _pack(bits.astype(uint8))
+
+def parities(outcomes,masks):
+    """
+    Calculate the parity of each outcome restricted to each mask
+    arguments:
+        outcomes (numpy.ndarray of uint64, shape (n_outcomes,n_words)): as returned by counts2arrays
+        masks (numpy.ndarray of uint64, shape (n_masks,n_words)): as returned by pauli_masks
+    returns:
+        numpy.ndarray of uint8, shape (n_masks,n_outcomes): 1 where an odd number of the masked bits are set, otherwise 0
+    """
+    out=zeros((len(masks),len(outcomes)),dtype=uint8)
+    step=max(1,_BLOCK//max(1,outcomes.size))
+    for start in range(0,len(masks),step):
+        words=bitwise_xor.reduce(outcomes[None,:,:]&masks[start:start+step,None,:],axis=2)
+        for shift in (32,16,8,4,2,1): words^=words>>uint64(shift)
+        out[start:start+step]=words&uint64(1)
+    return out
+
+def expectation_values(counts,paulis,mitigator=None):
+    """
+    Evaluate a set of Pauli operators from counts measured in a basis that contains all of them
+    arguments:
+        counts (dict): bitstrings as keys and frequencies as values
+        paulis (iterable of str): the Pauli strings to evaluate
+        mitigator, optional (mitigation.ReadoutMitigator): if provided, the values are corrected for readout errors
+    returns:
+        values (numpy.ndarray of float): the expectation value of each Pauli string
+        variances (numpy.ndarray of float): the shot noise variance of each expectation value
+    """
+    if mitigator is not None: return mitigator.expectation_values(counts,paulis)
+    outcomes,weights,width=counts2arrays(counts)
+    shots=weights.sum()
+    signs=1-2*parities(outcomes,pauli_masks(paulis,width)).astype(float)
+    values=signs@weights/shots
+    return values,(1-values**2)/shots
+
+def evaluate_pauli(pauli,results,mitigator=None):
+    """
+    Evaluate a single Pauli string from a set of counts (see expectation_values to evaluate several at once)
+    arguments:
+        pauli (str): the Pauli string to evaluate
+        results (dict): bitstrings as keys and frequencies as values
+        mitigator, optional (mitigation.ReadoutMitigator): if provided, the value is corrected for readout errors
+    returns:
+        float: the expectation value
+    """
+    return float(expectation_values(results,(pauli,),mitigator)[0][0])
+
+def energy(hamiltonian,bases,lookup=None,mitigator=None):
+    """
+    Evaluate a Hamiltonian from a set of measured bases
+    arguments:
+        hamiltonian (dict): Pauli strings as keys and coefficients as values
+        bases (iterable of PauliBasis): the measured bases, results must have been assigned (e.g. by CountsBackend.run)
+        lookup, optional (dict): maps each term to the basis in which it was measured (as returned by grouping.group_paulis, bases are matched by equality so copies of the bases may be evaluated), if not provided each term is evaluated using the first basis that contains it
+        mitigator, optional (mitigation.ReadoutMitigator): if provided, the energy is corrected for readout errors (and its variance includes the cost of the correction)
+    returns:
+        energy (float): the expectation value of the Hamiltonian
+        variance (float): the shot noise variance of the energy, including covariances between terms measured in the same basis
+    """
+    E=var=0
+    with instrument.stage('score',terms=len(hamiltonian)):
+        for basis,terms in _group_terms(hamiltonian,bases,lookup):
+            e,v=_basis_energy(basis.results,terms,mitigator)
+            E+=e
+            var+=v
+    return E,var
+
+def bootstrap_energy(hamiltonian,bases,lookup=None,resamples=1000,seed=None,mitigator=None):
+    """
+    Estimate the error of a Hamiltonian evaluated from a single set of measurements by multinomial (bootstrap) resampling of the counts in each basis
+    arguments:
+        hamiltonian (dict): Pauli strings as keys and coefficients as values
+        bases (iterable of PauliBasis): the measured bases, results must have been assigned (e.g. by CountsBackend.run)
+        lookup, optional (dict): maps each term to the basis in which it was measured (see energy)
+        resamples (int, default 1000): the number of bootstrap resamples
+        seed, optional (int or numpy.random.Generator): the seed of the random number generator
+        mitigator, optional (mitigation.ReadoutMitigator): if provided, the energy is corrected for readout errors
+    returns:
+        energy (float): the expectation value of the Hamiltonian (evaluated from the measured counts)
+        error (float): the standard error of the energy (the standard deviation of the resampled energies)
+    """
+    rng=default_rng(seed)
+    E=0
+    energies=zeros(resamples)
+    with instrument.stage('score',terms=len(hamiltonian),resamples=resamples):
+        for basis,terms in _group_terms(hamiltonian,bases,lookup):
+            paulis,coeffs=zip(*terms)
+            outcomes,weights,width=counts2arrays(basis.results)
+            shots=int(weights.sum())
+            values=asarray(coeffs,dtype=float)@_estimates(outcomes,width,paulis,mitigator)
+            E+=values@weights/shots
+            step=max(1,_BLOCK//len(values))
+            energies+=concatenate([rng.multinomial(shots,weights/shots,size=min(step,resamples-start))@values
+                                   for start in range(0,resamples,step)])/shots
+    return float(E),float(energies.std(ddof=1))
+
+def _group_terms(hamiltonian,bases,lookup=None):
+    """
+    Assign each term of a Hamiltonian to a measured basis
+    returns:
+        list of (basis,list of (pauli,coeff))
+    """
+    bases=tuple(bases)
+    if lookup is not None: index={basis:ix for ix,basis in enumerate(bases)}
+    groups={}
+    for pauli,coeff in hamiltonian.items():
+        try:
+            if lookup is not None: ix=index[lookup[pauli]]
+            else: ix=next(ix for ix,basis in enumerate(bases) if basis.contains(pauli))
+        except (KeyError,StopIteration): raise ValueError(f'The term {pauli} is not measured in any of the bases')
+        groups.setdefault(ix,[]).append((pauli,coeff))
+    return [(bases[ix],terms) for ix,terms in groups.items()]
+
+def _basis_energy(counts,terms,mitigator=None):
+    """
+    Evaluate a weighted sum of Pauli strings from the counts of a single basis
+    """
+    paulis,coeffs=zip(*terms)
+    outcomes,weights,width=counts2arrays(counts)
+    shots=weights.sum()
+    values=asarray(coeffs,dtype=float)@_estimates(outcomes,width,paulis,mitigator)
+    E=values@weights/shots
+    return float(E),float(max(0,(values**2)@weights/shots-E**2)/shots)
+
+def _estimates(outcomes,width,paulis,mitigator=None):
+    """
+    The single shot value (n_paulis,n_outcomes) of each Pauli string for each outcome: the +-1 parities, or the readout corrected estimates of a mitigator
+    """
+    if mitigator is not None: return mitigator.estimates(outcomes,width,paulis)
+    return 1-2*parities(outcomes,pauli_masks(paulis,width)).astype(float)
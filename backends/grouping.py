@@ -0,0 +1,114 @@
+# quantum-computed-chemistry/backends/grouping.py
+# Groups Hamiltonian terms into qubit-wise commuting sets so that each set can be measured in a single PauliBasis
+
+#numpy
+from numpy import zeros,empty,argmin,count_nonzero,bitwise_xor,bitwise_or,uint64
+
+#qcchem
+from .counts_backendwrapper import PauliBasis
+from .estimator import _BLOCK
+
+def group_paulis(hamiltonian,method='greedy'):
+    """
+    Find a small set of measurement bases that covers every term of a Hamiltonian
+    arguments:
+        hamiltonian (dict or iterable of str): Pauli strings as keys and coefficients as values (only the keys are used)
+        method (str, default 'greedy'): the heuristic used to form the groups:
+            'greedy': terms are added (largest weight first) to the first compatible group
+            'colouring': largest-first colouring of the graph whose edges join terms that do not qubit-wise commute
+    returns:
+        bases (tuple of PauliBasis): the measurement bases
+        lookup (dict): maps each term of the Hamiltonian to the basis in which it is measured
+    """
+    terms={}
+    for p in hamiltonian: terms.setdefault(PauliBasis(p),[]).append(p)
+    if method=='greedy': groups=_greedy(list(terms))
+    elif method=='colouring': groups=_colouring(list(terms))
+    else: raise ValueError(f'Unknown grouping method "{method}"')
+    bases=tuple(basis for basis,members in groups)
+    return bases,{p:basis for basis,members in groups for term in members for p in terms[term]}
+
+def _greedy(terms):
+    """
+    Add each term to the first compatible group, visiting the terms with the most non-identity elements first
+    """
+    return _assign(sorted(sorted(terms,key=_label),key=_weight,reverse=True))
+
+def _colouring(terms):
+    """
+    Colour the conflict graph of the terms (largest degree first), each colour forms a group
+        the smallest colour not used by a conflicting term is the first group whose basis commutes with the term (the members of a group qubit-wise commute, so a term commutes with all of them if and only if it commutes with their union), so only the degrees of the graph are computed (in blocks) rather than the graph itself
+    """
+    terms=sorted(terms,key=_label)
+    x,z=_words(terms)
+    support=x|z
+    degrees=[]
+    step=max(1,_BLOCK//max(1,x.size))
+    for start in range(0,len(terms),step):
+        block=slice(start,start+step)
+        conflict=x[block,None]^x[None]
+        conflict|=z[block,None]^z[None]
+        conflict&=support[block,None]
+        conflict&=support[None]
+        degrees.extend(count_nonzero(bitwise_or.reduce(conflict,axis=2),axis=1).tolist())
+    degree=dict(zip(terms,degrees))
+    return _assign(sorted(terms,key=lambda t:(degree[t],_weight(t)),reverse=True))
+
+def _assign(terms):
+    """
+    Add each term (in order) to the first group whose basis qubit-wise commutes with it, testing every group at once using arrays of the group masks
+    """
+    x,z=_words(terms)
+    #the masks of each group, in the order the groups were created (at most one group per term)
+    group_x,group_z,group_support=(zeros(x.shape,dtype=uint64) for _ in range(3))
+    differ,buffer=empty(x.shape,dtype=uint64),empty(x.shape,dtype=uint64)
+    members,widths=[],[]
+    for ix,term in enumerate(terms):
+        n=len(members)
+        tx,tz=x[ix],z[ix]
+        support=tx|tz
+        #the qubits on which a group and the term have different non-identity elements
+        d=bitwise_xor(group_x[:n],tx,out=differ[:n])
+        d|=bitwise_xor(group_z[:n],tz,out=buffer[:n])
+        d&=group_support[:n]
+        d&=support
+        conflict=d.any(axis=1)
+        g=int(argmin(conflict)) if n else 0
+        if n and not conflict[g]:
+            group_x[g]|=tx
+            group_z[g]|=tz
+            group_support[g]|=support
+            members[g].append(term)
+            widths[g]=max(widths[g],len(term))
+        else:
+            group_x[n],group_z[n],group_support[n]=tx,tz,support
+            members.append([term])
+            widths.append(len(term))
+    return [[PauliBasis.from_masks(_int(gx),_int(gz),n),group] for gx,gz,n,group in zip(group_x,group_z,widths,members)]
+
+def _words(terms):
+    """
+    The x and z masks of each term as arrays of 64 bit words (n_terms,n_words), word k holds qubits 64*k to 64*k+63
+    """
+    n_words=max(1,-(-max((len(term) for term in terms),default=1)//64))
+    x,z=zeros((len(terms),n_words),dtype=uint64),zeros((len(terms),n_words),dtype=uint64)
+    for ix,term in enumerate(terms):
+        tx,tz=term.masks
+        for k in range(n_words):
+            x[ix,k]=tx>>64*k&0xFFFFFFFFFFFFFFFF
+            z[ix,k]=tz>>64*k&0xFFFFFFFFFFFFFFFF
+    return x,z
+
+def _int(words):
+    """
+    Convert an array of 64 bit words back to a (Python int) mask
+    """
+    return sum(int(w)<<64*k for k,w in enumerate(words))
+
+def _label(basis):
+    #sorting by the label (computed once per term) is the order of PauliBasis comparisons
+    return basis.basis
+
+def _weight(basis):
+    x,z=basis.masks
+    return bin(x|z).count('1')
@@ -0,0 +1,153 @@
+# quantum-computed-chemistry/backends/instrument.py
+# Opt-in timing of each stage of the backend wrappers (transpile, assemble, submit, wait, parse, score)
+#
+# usage:
+#   from backends import instrument
+#   sink=instrument.enable()    # or enable(JSONLinesSink('timings.jsonl')) or enable(CallbackSink(print))
+#   ... run a sweep ...
+#   print(instrument.report())
+#   instrument.disable()
+
+#core
+import json
+from time import perf_counter
+
+#the active sink, None when instrumentation is disabled
+_SINK=None
+
+class Sink():
+    """
+    Receives a record (dict with 'stage', 'duration' and any other information) for each completed stage, and keeps a summary per stage
+    """
+    def __init__(self):
+        self.totals={}
+    def record(self,record):
+        total=self.totals.setdefault(record['stage'],{'calls':0,'duration':0.,'max_duration':0.})
+        total['calls']+=1
+        total['duration']+=record['duration']
+        total['max_duration']=max(total['max_duration'],record['duration'])
+        #numbers are summed (e.g. circuits, shots), except those named max_* (e.g. max_depth) of which the maximum is kept
+        for key,value in record.items():
+            if key in ('stage','duration') or not isinstance(value,(int,float)) or isinstance(value,bool): continue
+            if key.startswith('max_'): total[key]=max(total.get(key,value),value)
+            else: total[key]=total.get(key,0)+value
+        self.emit(record)
+    def emit(self,record):
+        pass
+
+class MemorySink(Sink):
+    """
+    Keeps every record in MemorySink.records
+    """
+    def __init__(self):
+        super().__init__()
+        self.records=[]
+    def emit(self,record):
+        self.records.append(record)
+
+class JSONLinesSink(Sink):
+    """
+    Appends each record as a line of JSON to a file
+    """
+    def __init__(self,path):
+        super().__init__()
+        self.path=path
+    def emit(self,record):
+        with open(self.path,'a') as f: f.write(json.dumps(record,default=str)+'\n')
+
+class CallbackSink(Sink):
+    """
+    Passes each record to a function
+    """
+    def __init__(self,callback):
+        super().__init__()
+        self.callback=callback
+    def emit(self,record):
+        self.callback(record)
+
+class _Stage():
+    """
+    Times a stage and sends the record to the active sink on exit, further information can be added with _Stage.update
+    """
+    __slots__=('sink','info','start')
+    def __init__(self,sink,info):
+        self.sink=sink
+        self.info=info
+    def __enter__(self):
+        self.start=perf_counter()
+        return self
+    def __exit__(self,*exc):
+        self.info['duration']=perf_counter()-self.start
+        self.sink.record(self.info)
+        return False
+    def update(self,**info):
+        self.info.update(info)
+    def __bool__(self):
+        return True
+
+class _Disabled():
+    """
+    The stage used when instrumentation is disabled, does nothing and is falsy (so expensive information can be skipped with `if s: s.update(...)`)
+    """
+    __slots__=()
+    def __enter__(self):
+        return self
+    def __exit__(self,*exc):
+        return False
+    def update(self,**info):
+        pass
+    def __bool__(self):
+        return False
+
+_DISABLED=_Disabled()
+
+def stage(name,**info):
+    """
+    A context manager timing a stage
+    arguments:
+        name (str): the name of the stage
+        **info: any other information to record (e.g. number of circuits, shots)
+    returns:
+        context manager, entering returns an object with an update(**info) method and which is falsy if instrumentation is disabled
+    """
+    if _SINK is None: return _DISABLED
+    info['stage']=name
+    return _Stage(_SINK,info)
+
+def enable(sink=None):
+    """
+    Start recording stages
+    arguments:
+        sink, optional (Sink): where records are sent (default is a new MemorySink)
+    returns:
+        the sink
+    """
+    global _SINK
+    _SINK=MemorySink() if sink is None else sink
+    return _SINK
+
+def disable():
+    """
+    Stop recording stages
+    returns:
+        the sink that was active (or None)
+    """
+    global _SINK
+    sink,_SINK=_SINK,None
+    return sink
+
+def report(sink=None):
+    """
+    Summarise the recorded stages
+    arguments:
+        sink, optional (Sink): the sink to summarise (default is the active sink)
+    returns:
+        str: a table with the number of calls, total and maximum duration and totals of any other recorded numbers for each stage
+    """
+    sink=_SINK if sink is None else sink
+    if sink is None or not len(sink.totals): return 'No stages recorded'
+    lines=[f'{"stage":<16}{"calls":>8}{"total (s)":>12}{"max (s)":>12}  other']
+    for name,total in sorted(sink.totals.items(),key=lambda item:-item[1]['duration']):
+        other=', '.join(f'{k}={v}' for k,v in total.items() if k not in ('calls','duration','max_duration'))
+        lines.append(f'{name:<16}{total["calls"]:>8}{total["duration"]:>12.4f}{total["max_duration"]:>12.4f}  {other}')
+    return '\n'.join(lines)
@@ -7,7 +7,7 @@ from .counts_backendwrapper import CountsBackend
 from .base_backendwrapper import is_statevector
 from .account import all_backends
 
-def get_backendwrapper(name):
+def get_backendwrapper(name,cache=None):
     """
     Get the wrapper for the backend with a given name:
     arguments:
@@ -17,11 +17,12 @@ def get_backendwrapper(name):
             'fake(XXX)' where XXX is the name of an IBMQ backend (without prefix), e.g. 'fake(montreal)':
                 alternatively 'fake_montreal' or 'qasm_simulator(fake_montreal)'
             'simX' where 'X' is replaced by a number: a simulated backend with an depolarising and readout errors at X times device level
+        cache, optional (str or ResultCache): a persistent cache of counts (or the directory in which to store it), used for seeded runs, ignored by statevector backends
     returns:
         a CountsBackend or StatevectorBackend wrapper to the IBMQ device or simulator
     """
     if isinstance(name,str):
         if is_statevector(name): return StatevectorBackend(name)
-        return CountsBackend(name)
+        return CountsBackend(name,cache)
     elif is_statevector(name.name()): return StatevectorBackend(name)
-    return CountsBackend(name)
+    return CountsBackend(name,cache)
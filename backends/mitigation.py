@@ -0,0 +1,134 @@
+# quantum-computed-chemistry/backends/mitigation.py
+# Tensored readout error mitigation: independent confusion matrices for each qubit, calibrated with two circuits
+
+#numpy
+from numpy import asarray,concatenate,unique,bincount,where,empty,clip
+
+#qiskit
+from qiskit import QuantumCircuit
+
+#qcchem
+from .cache import LRUCache
+from .counts import Counts,_pack,_unpack
+from .estimator import pauli_masks,_BLOCK
+from .resultcache import backend_fingerprint
+
+#calibrations that have already been measured, keyed by backend (name and noise model), number of qubits and shots
+CALIBRATIONS=LRUCache(maxsize=32)
+
+class ReadoutMitigator():
+    """
+    Readout error mitigation assuming the readout errors of each qubit are independent, so the full 2**n confusion matrix is the tensor product of a 2x2 matrix per qubit
+        a measured z'=+-1 on qubit i has E[z']=c_i+a_i*z (a_i=1-e0_i-e1_i, c_i=e1_i-e0_i), so (z'-c_i)/a_i is an unbiased single shot estimate of z, and the product over the support of a Pauli string is an unbiased estimate of its expectation value
+        main methods:
+            ReadoutMitigator.calibrate
+            ReadoutMitigator.expectation_values
+            ReadoutMitigator.counts
+    attributes:
+        e0 (numpy.ndarray, shape (n_qubits,)): the probability of measuring 1 when qubit i is prepared in 0
+        e1 (numpy.ndarray, shape (n_qubits,)): the probability of measuring 0 when qubit i is prepared in 1
+    """
+    def __init__(self,e0,e1):
+        self.e0=asarray(e0,dtype=float)
+        self.e1=asarray(e1,dtype=float)
+        if (self.e0+self.e1>=1).any(): raise ValueError('Readout errors are too large to be inverted (e0+e1>=1)')
+    @classmethod
+    def calibrate(cls,backend,n_qubits,shots=8192,seed=None):
+        """
+        Measure the readout errors of the first n_qubits qubits by preparing all zeros and all ones (two circuits, whatever the number of qubits)
+            NB. the calibration circuits are transpiled with the default layout, which should match the layout of the circuits being mitigated
+        arguments:
+            backend (CountsBackend): the backend to calibrate
+            n_qubits (int): the number of qubits
+            shots (int, default 8192): the number of measurements of each circuit
+            seed, optional (int): the seed used by simulators
+        returns:
+            ReadoutMitigator
+        """
+        circuits=[QuantumCircuit(n_qubits,n_qubits) for _ in range(2)]
+        circuits[1].x(range(n_qubits))
+        #character i of the measured bitstrings is qubit i (see PauliBasis.apply)
+        zeros,ones=(Counts.from_dict(backend.run(circuit,shots=shots,seed=seed)[0].results) for circuit in circuits)
+        return cls(zeros.bits().T@zeros.counts/zeros.shots,1-ones.bits().T@ones.counts/ones.shots)
+    @property
+    def gain(self):
+        return 1-self.e0-self.e1
+    @property
+    def offset(self):
+        return self.e1-self.e0
+    def estimates(self,outcomes,width,paulis):
+        """
+        The single shot estimates of each Pauli string for each outcome (used in place of the +-1 parities by estimator functions)
+        arguments:
+            outcomes (numpy.ndarray of uint64, shape (n_outcomes,n_words)): as returned by estimator.counts2arrays
+            width (int): the number of bits in each outcome
+            paulis (iterable of str): the Pauli strings, element i acts on qubit i
+        returns:
+            numpy.ndarray, shape (n_paulis,n_outcomes)
+        """
+        if width>len(self.e0): raise ValueError(f'The mitigator was calibrated for {len(self.e0)} qubits but the outcomes have {width} bits')
+        z=(1-2*_unpack(outcomes,width).astype(float)-self.offset[:width])/self.gain[:width]
+        support=_unpack(pauli_masks(paulis,width),width).astype(bool)
+        out=empty((len(support),len(z)))
+        step=max(1,_BLOCK//max(1,z.size))
+        for start in range(0,len(support),step):
+            out[start:start+step]=where(support[start:start+step,None,:],z[None,:,:],1).prod(axis=2)
+        return out
+    def expectation_values(self,counts,paulis):
+        """
+        Evaluate a set of Pauli operators from counts measured in a basis that contains all of them, correcting for readout errors
+        arguments:
+            counts (dict or Counts): bitstrings as keys and frequencies as values
+            paulis (iterable of str): the Pauli strings to evaluate
+        returns:
+            values (numpy.ndarray of float): the mitigated expectation value of each Pauli string
+            variances (numpy.ndarray of float): the shot noise variance of each value (which is increased by the mitigation)
+        """
+        counts=Counts.from_dict(counts)
+        weights=asarray(counts.counts,dtype=float)
+        shots=weights.sum()
+        estimates=self.estimates(asarray(counts.outcomes),counts.width,paulis)
+        values=estimates@weights/shots
+        return values,clip(estimates**2@weights/shots-values**2,0,None)/shots
+    def counts(self,counts):
+        """
+        Apply the inverse of the (tensored) confusion matrix to a set of counts, one qubit at a time so only outcomes reachable from the measured outcomes are generated
+        arguments:
+            counts (dict or Counts): bitstrings as keys and frequencies as values
+        returns:
+            dict: bitstrings as keys and quasi-frequencies (which may be negative, but sum to the number of shots) as values
+        """
+        counts=Counts.from_dict(counts)
+        if counts.width>len(self.e0): raise ValueError(f'The mitigator was calibrated for {len(self.e0)} qubits but the outcomes have {counts.width} bits')
+        bits=counts.bits()
+        weights=asarray(counts.counts,dtype=float)
+        for i in range(counts.width):
+            #inverse of [[1-e0,e1],[e0,1-e1]] (rows measured, columns prepared)
+            e0,e1,a=self.e0[i],self.e1[i],self.gain[i]
+            inverse=asarray([[1-e1,-e1],[-e0,1-e0]])/a
+            b=bits[:,i]
+            flipped=bits.copy()
+            flipped[:,i]^=1
+            bits=concatenate([bits,flipped])
+            weights=concatenate([weights*inverse[b,b],weights*inverse[1-b,b]])
+            words,inv=unique(_pack(bits),axis=0,return_inverse=True)
+            weights=bincount(inv.ravel(),weights=weights,minlength=len(words))
+            bits=_unpack(words,counts.width)
+        keep=weights!=0
+        out=Counts(_pack(bits[keep]),weights[keep],counts.width,counts.spaces)
+        return dict(zip(out.keys(),weights[keep]))
+
+def get_mitigator(backend,n_qubits,shots=8192,seed=None):
+    """
+    Calibrate a backend, or reuse a previous calibration of the same backend and noise model (see CALIBRATIONS)
+    arguments:
+        see ReadoutMitigator.calibrate
+    returns:
+        ReadoutMitigator
+    """
+    key=(backend_fingerprint(backend),n_qubits,shots)
+    mitigator=CALIBRATIONS.get(key)
+    if mitigator is None:
+        mitigator=ReadoutMitigator.calibrate(backend,n_qubits,shots,seed)
+        CALIBRATIONS[key]=mitigator
+    return mitigator
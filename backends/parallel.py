@@ -0,0 +1,60 @@
+# quantum-computed-chemistry/backends/parallel.py
+# Runs independent experiments of a sweep (optionally on several backends) in a pool of processes
+
+#core
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from copy import copy
+
+#qcchem
+from .interface import get_backendwrapper
+
+def parallel_sweep(names,experiments,bases,shots=8192,seed=None,workers=None):
+    """
+    Measure many state preparation circuits in parallel, each experiment is run by a worker process on its own copy of the backend
+        workers are started with the 'spawn' method, so scripts calling this must guard their entry point with if __name__=='__main__'
+    see also:
+        CountsBackend.sweep
+    arguments:
+        names (str or iterable of str): the name(s) of the backends to run on (e.g. 'sim1' or ('sim1','sim2','sim3')), backends are rebuilt from their names in each worker so they must be valid arguments to get_backendwrapper
+        experiments (dict): keys label each experiment (e.g. (point,depth,repeat)), values are state preparation circuits or (circuit,parameters) tuples
+        bases (iterable of PauliBasis): the bases in which each prepared state should be measured
+        shots (int, default 8192): the number of measurements to be taken in each basis
+        seed, optional (int): if provided each experiment is run with a simulator seed derived from seed, the backend name and the experiment key (see task_seed), so results do not depend on the number of workers
+        workers, optional (int): the number of worker processes (default is the number of processors)
+    returns:
+        dict: if names is a string, the same keys as experiments, otherwise (name,key) for each backend and experiment, values are tuples of copies of bases, the results can be retrieved using results[key][ix].results
+    """
+    single=isinstance(names,str)
+    names=(names,) if single else tuple(names)
+    bases=tuple(bases)
+    tasks=[(name,key,experiment,bases,shots,None if seed is None else task_seed(seed,name,key))
+           for name in names for key,experiment in experiments.items()]
+    #workers are spawned rather than forked, a process forked after Aer has run a job deadlocks
+    with ProcessPoolExecutor(workers,mp_context=multiprocessing.get_context('spawn')) as pool: results=list(pool.map(_run_task,tasks))
+    out={}
+    for (name,key,*_),counts in zip(tasks,results):
+        out[key if single else (name,key)]=tuple(copy(basis) for basis in bases)
+        for basis,res in zip(out[key if single else (name,key)],counts): basis.results=res
+    return out
+
+def task_seed(seed,*labels):
+    """
+    Derive a simulator seed for a single task (independent of process, worker count and the order tasks are run in)
+    arguments:
+        seed (int): the seed of the whole sweep
+        *labels: identify the task (e.g. backend name and experiment key), these must have a deterministic repr
+    returns:
+        int: a seed in the range [0,2**31)
+    """
+    return int.from_bytes(sha256(repr((seed,)+labels).encode()).digest()[:4],'little')>>1
+
+def _run_task(task):
+    """
+    Run a single experiment in a worker process, returning the counts measured in each basis
+    """
+    name,key,experiment,bases,shots,seed=task
+    circuit,parameters=experiment if isinstance(experiment,tuple) else (experiment,None)
+    bases=get_backendwrapper(name).run(circuit,[copy(basis) for basis in bases],shots,parameters,seed)
+    return tuple(basis.results for basis in bases)
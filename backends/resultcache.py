@@ -0,0 +1,135 @@
+# quantum-computed-chemistry/backends/resultcache.py
+# A persistent, content-addressed cache of measurement counts so that repeated runs of the same circuits are not re-executed
+
+#core
+import os
+from hashlib import sha256
+from tempfile import mkstemp
+from json import dumps
+
+#qcchem
+from .counts import Counts
+
+class ResultCache():
+    """
+    An on-disk cache of counts, keyed by a hash of everything that determines the result of a circuit
+        each entry is stored in its own binary file (written atomically so concurrent readers never see partial entries), the least recently used entries are removed once the cache exceeds max_bytes
+        main methods:
+            ResultCache.key
+            ResultCache.get
+            ResultCache.put
+            ResultCache.clear
+    """
+    def __init__(self,path,max_bytes=2**30):
+        """
+        arguments:
+            path (str): the directory in which to store the cache (created if it doesn't exist)
+            max_bytes (int, default 1GiB): the maximum total size of the cached entries
+        """
+        self.path=path
+        self.max_bytes=max_bytes
+        self.hits=0
+        self.misses=0
+        os.makedirs(path,exist_ok=True)
+        self._size=sum(size for _,size,_ in self._entries())
+    def key(self,circuit,basis=None,shots=None,seed=None,backend=None,occurrence=0):
+        """
+        Generate the key of an experiment
+        arguments:
+            circuit (qiskit.QuantumCircuit): the complete (transpiled and bound) circuit
+            basis, optional (PauliBasis): the measurement basis
+            shots, optional (int): the number of measurements
+            seed, optional (int): the simulator seed
+            backend, optional (BackendWrapper or str): the backend (its name and noise model are included in the key) or its fingerprint (see backend_fingerprint)
+            occurrence (int, default 0): distinguishes repeated measurements of the same circuit (e.g. repeats in a sweep), which would otherwise share an entry
+        returns:
+            str: a hexadecimal digest
+        """
+        digest=sha256(circuit.qasm().encode())
+        digest.update(dumps([str(getattr(basis,'basis',basis)),shots,seed]+([occurrence] if occurrence else [])).encode())
+        if backend is not None: digest.update((backend if isinstance(backend,str) else backend_fingerprint(backend)).encode())
+        return digest.hexdigest()
+    def get(self,key):
+        """
+        Retrieve an entry
+        arguments:
+            key (str): as returned by ResultCache.key
+        returns:
+            Counts or None: the counts (bitstrings as keys and frequencies as values), or None if the key is not in the cache
+        """
+        try:
+            with open(self._file(key),'rb') as f: data=f.read()
+        except FileNotFoundError:
+            self.misses+=1
+            return None
+        self.hits+=1
+        try: os.utime(self._file(key))
+        except OSError: pass
+        return Counts.frombytes(data)
+    def put(self,key,counts):
+        """
+        Store an entry
+        arguments:
+            key (str): as returned by ResultCache.key
+            counts (dict or Counts): bitstrings as keys and frequencies as values
+        """
+        data=Counts.from_dict(counts).tobytes()
+        fd,tmp=mkstemp(dir=self.path,suffix='.tmp')
+        with os.fdopen(fd,'wb') as f: f.write(data)
+        os.replace(tmp,self._file(key))
+        self._size+=len(data)
+        if self._size>self.max_bytes: self.evict()
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is at most 90% of max_bytes
+        """
+        entries=sorted(self._entries(),key=lambda entry:entry[2])
+        self._size=sum(size for _,size,_ in entries)
+        for name,size,_ in entries:
+            if self._size<=0.9*self.max_bytes: break
+            try: os.remove(os.path.join(self.path,name))
+            except FileNotFoundError: pass
+            self._size-=size
+    def clear(self):
+        """
+        Remove every entry
+        """
+        for name,_,_ in self._entries(): os.remove(os.path.join(self.path,name))
+        self._size=0
+    def __len__(self):
+        return len(self._entries())
+    def _file(self,key):
+        return os.path.join(self.path,key+'.counts')
+    def _entries(self):
+        """
+        returns:
+            list of (file name, size, last access time) for every entry
+        """
+        entries=[]
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith('.counts'): continue
+            try: stat=entry.stat()
+            except FileNotFoundError: continue
+            entries.append((entry.name,stat.st_size,stat.st_mtime))
+        return entries
+
+def backend_fingerprint(backend):
+    """
+    A string identifying a backend and (for simulators) its noise model
+    arguments:
+        backend (BackendWrapper)
+    returns:
+        str
+    """
+    try: noise_model=backend.backend.options.noise_model
+    except AttributeError: noise_model=None
+    if noise_model is None: return backend.name
+    return backend.name+sha256(dumps(_stable(noise_model.to_dict()),default=str,sort_keys=True).encode()).hexdigest()
+
+def _stable(value):
+    """
+    Remove the 'id' fields (random for each QuantumError instance) from a serialised noise model, so the fingerprint is the same in every process
+    """
+    if isinstance(value,dict): return {k:_stable(v) for k,v in value.items() if k!='id'}
+    if isinstance(value,(list,tuple)): return [_stable(v) for v in value]
+    return value
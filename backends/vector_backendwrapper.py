@@ -1,11 +1,18 @@
 # quantum-computed-chemistry/backends/statevector_backendwrapper.py
 # A class to wrap backends that return statevectors (as opposed to counts)
 
+#numpy
+from numpy import asarray,arange,zeros,uint64,array
+
 #qiskit
 from qiskit.compiler import transpile
 
 #qcchem
 from .base_backendwrapper import BackendWrapper
+from .cache import TRANSPILE_CACHE,circuit_key
+from .counts_backendwrapper import PauliBasis
+from .estimator import parities,_BLOCK
+from . import instrument
 
 class StatevectorBackend(BackendWrapper):
     """
@@ -15,6 +22,7 @@ class StatevectorBackend(BackendWrapper):
             StatevectorBackend.circ2circuits
             StatevectorBackend.circuits2jobs
             StatevectorBackend.jobs2vector
+            StatevectorBackend.expectation
     """
     def circ2circuits(self,circuit,bases=None):
         """
@@ -26,7 +34,10 @@ class StatevectorBackend(BackendWrapper):
             (circuit,)
         """
         #qubits and meas_basis are not required but are included so the call signature matches CountsBackend.circ2circuits
-        return (transpile(circuit,self),)
+        with instrument.stage('transpile',backend=self.name,circuits=1,transpiled=1) as s:
+            circuit=transpile(circuit,self)
+            if s: s.update(max_depth=circuit.depth())
+        return (circuit,)
     def jobs2vector(self,jobs):
         """
         Retrieve the results for a previously submitted batch of jobs
@@ -37,7 +48,8 @@ class StatevectorBackend(BackendWrapper):
         """
         assert len(jobs)==1
         if isinstance(jobs[0],str): jobs=[self.retrieve_job(job) for job in jobs]
-        return jobs[0].result().get_statevector()
+        with instrument.stage('parse',backend=self.name,circuits=1):
+            return jobs[0].result().get_statevector()
     def jobs2counts(self,jobs,basis=None):
         """
         alias to jobs2vector
@@ -60,3 +72,60 @@ class StatevectorBackend(BackendWrapper):
         """
         #qubits, meas_basis and measurment_method are not required but are included so the call signature matches CountsBackend.run
         return self.jobs2vector(self.circuits2jobs(self.circ2circuits(circuit)))
+    def expectation(self,circuit,hamiltonian,parameter_values=None):
+        """
+        Calculate the exact expectation value of a Hamiltonian directly from the statevector (no sampling), for one or many parameter bindings
+            NB. the circuit is transpiled once and every binding is submitted together
+        arguments:
+            circuit (qiskit.QuantumCircuit): the state preparation circuit (without measurements)
+            hamiltonian (dict): Pauli strings as keys and coefficients as values, element i of each string acts on qubit i
+            parameter_values, optional (dict, or list of dicts or sequences): values to bind to the parameters of circuit, a list gives a batch of bindings
+        returns:
+            float, or numpy.ndarray (one value per binding) if a list of bindings is given
+        """
+        batch=isinstance(parameter_values,(list,tuple))
+        key=(self.cache_key,'statevector',circuit_key(circuit))
+        with instrument.stage('transpile',backend=self.name) as s:
+            template=TRANSPILE_CACHE.get(key)
+            if template is None:
+                template=transpile(circuit,self.backend)
+                TRANSPILE_CACHE[key]=template
+                if s: s.update(transpiled=1)
+            if parameter_values is None: circuits=[template]
+            else: circuits=[template.assign_parameters(values) for values in (parameter_values if batch else [parameter_values])]
+            if s: s.update(circuits=len(circuits),max_depth=template.depth())
+        jobs=self.circuits2jobs(circuits)
+        with instrument.stage('parse',backend=self.name,circuits=len(circuits)):
+            results=[job.result() for job in jobs]
+            states=asarray([result.get_statevector(ix) for result in results for ix in range(len(result.results))])
+        with instrument.stage('score',terms=len(hamiltonian),states=len(states)):
+            values=pauli_expectations(states,hamiltonian)
+        return values if batch else float(values[0])
+
+def pauli_expectations(states,hamiltonian):
+    """
+    Evaluate a Hamiltonian for a batch of statevectors
+    arguments:
+        states (numpy.ndarray, shape (n_states,2**n_qubits)): the statevectors (qubit i is bit i of the index)
+        hamiltonian (dict): Pauli strings as keys and coefficients as values, element i of each string acts on qubit i
+    returns:
+        numpy.ndarray, shape (n_states,): the expectation values
+    """
+    states=asarray(states)
+    index=arange(states.shape[1],dtype=uint64)
+    groups={}
+    for pauli,coeff in hamiltonian.items():
+        x,z=PauliBasis(pauli).masks
+        groups.setdefault(x,[]).append((z,coeff*1j**bin(x&z).count('1')))
+    out=zeros(len(states))
+    for x,terms in groups.items():
+        #P|k>=i^n_y*(-1)^(k.z)|k^x>, so <psi|P|psi>=i^n_y*sum_k conj(psi[k^x])*(-1)^(k.z)*psi[k]
+        overlap=states[:,index^uint64(x)].conj()*states
+        zs,coeffs=zip(*terms)
+        zs,coeffs=array(zs,dtype=uint64)[:,None],asarray(coeffs)
+        #the signs of each term are evaluated in blocks, so memory is bounded whatever the number of terms
+        step=max(1,_BLOCK//len(index))
+        for start in range(0,len(zs),step):
+            signs=1-2*parities(index[:,None],zs[start:start+step]).astype(float)
+            out+=((overlap@signs.T)@coeffs[start:start+step]).real
+    return out
@@ -0,0 +1,270 @@
+# quantum-computed-chemistry/benchmarks/benchmark.py
+# Times each stage of the measurement and extrapolation pipeline on offline backends
+#
+# usage (from the repository root):
+#   python -m benchmarks.benchmark --output results.json
+#   python -m benchmarks.benchmark --baseline results.json --tolerance 0.2
+#   python -m benchmarks.benchmark --check-cache --backends sim1 fake_montreal
+# each record holds the stage, its parameters, the best time (seconds) over --repeat runs and the peak memory (bytes) traced during one run
+
+#core
+import json
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from random import Random
+from tracemalloc import start,stop,get_traced_memory,reset_peak
+from copy import copy
+
+#numpy
+from numpy import arange,exp
+from numpy.random import default_rng
+
+#qiskit
+from qiskit import QuantumCircuit
+from qiskit.circuit import Parameter
+
+#qcchem
+from backends.interface import get_backendwrapper
+from backends.cache import TRANSPILE_CACHE
+from backends.estimator import energy
+from backends.grouping import group_paulis
+from extrapolation.fitting import fit_exponential
+
+def measure(function,repeat=3):
+    """
+    Time a function (best of repeat calls) and trace its peak memory (one further call)
+    arguments:
+        function (callable): called without arguments
+        repeat (int, default 3): the number of timed calls
+    returns:
+        dict: 'time' (seconds) and 'peak_memory' (bytes)
+    """
+    times=[]
+    for _ in range(repeat):
+        t0=perf_counter()
+        function()
+        times.append(perf_counter()-t0)
+    start()
+    reset_peak()
+    function()
+    peak=get_traced_memory()[1]
+    stop()
+    return {'time':min(times),'peak_memory':peak}
+
+def measure_stages(functions,repeat=3):
+    """
+    Time a sequence of dependent stages separately (e.g. submitting jobs then collecting their results), as measure but with a record per stage
+    arguments:
+        functions (iterable of callable): the first is called without arguments, each other is called with the value returned by the previous one
+        repeat (int, default 3): the number of timed runs of the sequence
+    returns:
+        list of dict: 'time' (seconds) and 'peak_memory' (bytes) of each stage
+    """
+    functions=list(functions)
+    times=[[] for _ in functions]
+    peaks=[]
+    for run in range(repeat+1):
+        value=None
+        for ix,function in enumerate(functions):
+            if run==repeat:
+                start()
+                reset_peak()
+            t0=perf_counter()
+            value=function() if ix==0 else function(value)
+            if run<repeat: times[ix].append(perf_counter()-t0)
+            else:
+                peaks.append(get_traced_memory()[1])
+                stop()
+    return [{'time':min(t),'peak_memory':peak} for t,peak in zip(times,peaks)]
+
+def random_hamiltonian(n_qubits,n_terms,seed=0):
+    """
+    A Hamiltonian of random Pauli strings with random coefficients
+    """
+    rng=Random(seed)
+    hamiltonian={}
+    while len(hamiltonian)<min(n_terms,4**n_qubits):
+        hamiltonian[''.join(rng.choice('IXYZ') for _ in range(n_qubits))]=rng.uniform(-1,1)
+    return hamiltonian
+
+def layered_circuit(n_qubits,depth):
+    """
+    A parameterised circuit of depth layers of Hadamards, rotations and a chain of CNOTs
+    """
+    theta=Parameter('theta')
+    circuit=QuantumCircuit(n_qubits,n_qubits)
+    for _ in range(depth):
+        for q in range(n_qubits):
+            circuit.h(q)
+            circuit.ry(theta/depth,q)
+        for q in range(n_qubits-1): circuit.cx(q,q+1)
+        circuit.barrier()
+    return circuit,theta
+
+def random_counts(n_qubits,shots,seed=0):
+    """
+    Counts of shots uniformly random outcomes
+    """
+    outcomes=default_rng(seed).integers(0,2**n_qubits,shots)
+    counts={}
+    for outcome in outcomes:
+        key=format(int(outcome),f'0{n_qubits}b')
+        counts[key]=counts.get(key,0)+1
+    return counts
+
+def bench_backend(name,qubits,depths,shots,repeat):
+    """
+    Stages which need a counts backend: transpilation (cold and cached), submission (assembling and submitting the jobs) and collection (waiting for the jobs to run and parsing the counts)
+    """
+    backend=get_backendwrapper(name)
+    records=[]
+    for n in qubits:
+        bases,_=group_paulis(random_hamiltonian(n,4*n))
+        for depth in depths:
+            circuit,theta=layered_circuit(n,depth)
+            params={'backend':name,'qubits':n,'depth':depth,'bases':len(bases)}
+            def cold():
+                TRANSPILE_CACHE.clear()
+                backend.circ2circuits(circuit,bases,{theta:0.1})
+            records.append(dict(stage='circ2circuits_cold',params=params,**measure(cold,repeat)))
+            backend.circ2circuits(circuit,bases,{theta:0.1})
+            records.append(dict(stage='circ2circuits_cached',params=params,**measure(lambda:backend.circ2circuits(circuit,bases,{theta:0.1}),repeat)))
+            circuits=backend.circ2circuits(circuit,bases,{theta:0.1})
+            for n_shots in shots:
+                p=dict(params,shots=n_shots)
+                submit,collect=measure_stages((lambda:backend.circuits2jobs(circuits,n_shots),lambda jobs:backend.jobs2counts(jobs,[copy(basis) for basis in bases])),repeat)
+                records.append(dict(stage='submit',params=p,**submit))
+                records.append(dict(stage='collect',params=p,**collect))
+    return records
+
+def bench_scoring(qubits,terms,shots,repeat):
+    """
+    Grouping a Hamiltonian and scoring it from (synthetic) counts
+    """
+    records=[]
+    for n in qubits:
+        for n_terms in terms:
+            hamiltonian=random_hamiltonian(n,n_terms)
+            params={'qubits':n,'terms':len(hamiltonian)}
+            records.append(dict(stage='group_paulis',params=params,**measure(lambda:group_paulis(hamiltonian),repeat)))
+            bases,lookup=group_paulis(hamiltonian)
+            for n_shots in shots:
+                for ix,basis in enumerate(bases): basis.results=random_counts(n,n_shots,ix)
+                records.append(dict(stage='energy',params=dict(params,shots=n_shots),**measure(lambda:energy(hamiltonian,bases,lookup),repeat)))
+    return records
+
+def bench_fitting(points,depths,repeat):
+    """
+    Fitting the exponential decay to every point at once, depths is the number of noise levels of each point (independent of the circuit depths of the other benchmarks, a fit needs at least 3)
+    """
+    rng=default_rng(0)
+    x=arange(1,3*depths+1,3)
+    y=rng.uniform(0.5,1,(points,1))*exp(-rng.uniform(0.01,0.1,(points,1))*x)+rng.normal(0,0.01,(points,len(x)))
+    return [dict(stage='fit_exponential',params={'points':points,'depths':len(x)},**measure(lambda:fit_exponential(x,y,0.01),repeat))]
+
+def bench_statevector(qubits,terms,repeat):
+    """
+    Exact expectation values for a batch of parameter bindings
+    """
+    backend=get_backendwrapper('vec')
+    records=[]
+    for n in qubits:
+        circuit,theta=layered_circuit(n,2)
+        circuit.remove_final_measurements()
+        hamiltonian=random_hamiltonian(n,terms)
+        bindings=[{theta:t} for t in range(10)]
+        records.append(dict(stage='expectation',params={'qubits':n,'terms':len(hamiltonian),'bindings':len(bindings)},**measure(lambda:backend.expectation(circuit,hamiltonian,bindings),repeat)))
+    return records
+
+def check_result_cache(name,shots=1024,seed=1):
+    """
+    Check that the persistent result cache is shared between processes: a sweep is run in a fresh process, then repeated in a second fresh process which should be served entirely from the cache
+    returns:
+        dict: the record, 'passed' is False if the second process missed any entry or returned different counts
+    """
+    with TemporaryDirectory() as path:
+        first,second=(_cached_sweep(path,name,shots,seed) for _ in range(2))
+    passed=second['misses']==0 and second['counts']==first['counts']
+    return {'stage':'result_cache','params':{'backend':name,'shots':shots},'hits':second['hits'],'misses':second['misses'],'passed':passed}
+
+def _cached_sweep(path,name,shots,seed):
+    """
+    Run a small cached sweep in a new (spawned) process
+    """
+    with ProcessPoolExecutor(1,mp_context=multiprocessing.get_context('spawn')) as pool: return pool.submit(_cached_sweep_task,path,name,shots,seed).result()
+
+def _cached_sweep_task(path,name,shots,seed):
+    backend=get_backendwrapper(name,cache=path)
+    bases,_=group_paulis(random_hamiltonian(2,8))
+    circuit,theta=layered_circuit(2,2)
+    results=backend.sweep({t:(circuit,{theta:t}) for t in range(3)},bases,shots,seed)
+    return {'hits':backend.cache.hits,'misses':backend.cache.misses,
+            'counts':[[dict(basis.results) for basis in results[t]] for t in range(3)]}
+
+def compare(records,baseline,tolerance):
+    """
+    Compare records with a baseline
+    arguments:
+        records (list of dict): as returned by run
+        baseline (list of dict): previously saved records
+        tolerance (float): the allowed fractional increase in time
+    returns:
+        list of dict: the records (with the baseline time and ratio) that are slower than the baseline by more than tolerance
+    """
+    reference={(r['stage'],json.dumps(r['params'],sort_keys=True)):r for r in baseline}
+    regressions=[]
+    for record in records:
+        old=reference.get((record['stage'],json.dumps(record['params'],sort_keys=True)))
+        if old is None: continue
+        record['baseline_time']=old['time']
+        record['ratio']=record['time']/old['time'] if old['time'] else float('inf')
+        if record['ratio']>1+tolerance: regressions.append(record)
+    return regressions
+
+def run(backends=('sim0','sim1'),qubits=(2,4),depths=(1,10),shots=(1024,8192),terms=(10,100,1000),points=100,repeat=3,fit_depths=10):
+    """
+    Run every benchmark
+    returns:
+        list of dict: one record per stage and set of parameters
+    """
+    records=[]
+    for name in backends: records+=bench_backend(name,qubits,depths,shots,repeat)
+    records+=bench_scoring(qubits,terms,shots,repeat)
+    records+=bench_fitting(points,fit_depths,repeat)
+    records+=bench_statevector(qubits,max(terms),repeat)
+    return records
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Benchmark the backends package and extrapolation pipeline')
+    parser.add_argument('--backends',nargs='+',default=['sim0','sim1'])
+    parser.add_argument('--qubits',nargs='+',type=int,default=[2,4])
+    parser.add_argument('--depths',nargs='+',type=int,default=[1,10])
+    parser.add_argument('--shots',nargs='+',type=int,default=[1024,8192])
+    parser.add_argument('--terms',nargs='+',type=int,default=[10,100,1000])
+    parser.add_argument('--points',type=int,default=100)
+    parser.add_argument('--fit-depths',type=int,default=10,help='the number of noise levels of each point in the fitting benchmark')
+    parser.add_argument('--repeat',type=int,default=3)
+    parser.add_argument('--output',help='write the records to this JSON file')
+    parser.add_argument('--baseline',help='compare with records previously written by --output')
+    parser.add_argument('--tolerance',type=float,default=0.2,help='allowed fractional slow down compared to the baseline')
+    parser.add_argument('--check-cache',action='store_true',help='only check that a second process is served from the result cache of each backend')
+    args=parser.parse_args(argv)
+    if args.check_cache:
+        checks=[check_result_cache(name) for name in args.backends]
+        for record in checks: print(json.dumps(record))
+        return 0 if all(record['passed'] for record in checks) else 1
+    records=run(args.backends,args.qubits,args.depths,args.shots,args.terms,args.points,args.repeat,args.fit_depths)
+    for record in records: print(json.dumps(record))
+    if args.output:
+        with open(args.output,'w') as f: json.dump(records,f,indent=1)
+    if args.baseline:
+        with open(args.baseline) as f: regressions=compare(records,json.load(f),args.tolerance)
+        for record in regressions: print(f'REGRESSION {record["stage"]} {record["params"]}: {record["time"]:.4g}s vs {record["baseline_time"]:.4g}s')
+        return 1 if len(regressions) else 0
+    return 0
+
+if __name__=='__main__':
+    raise SystemExit(main())
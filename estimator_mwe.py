@@ -1,16 +1,8 @@
 from qiskit import QuantumCircuit
 from qiskit.circuit.parameter import Parameter
 from backends.interface import get_backendwrapper
-from backends.counts_backendwrapper import PauliBasis
-
-def evaluate_pauli(pauli,results):
-    E=0
-    for bitstring,weight in results.items():
-        sign=1
-        for P,B in zip(pauli,bitstring):
-            if B=='1' and not P=='I': sign=-sign
-        E+=sign*weight
-    return E/sum(results.values())
+from backends.estimator import energy
+from backends.grouping import group_paulis
 
 backend=get_backendwrapper('sim0')
 theta=0
@@ -29,14 +21,9 @@ for i in range(circuit_reps):
     circ.barrier()
 
 Ham={'XX':1,'YY':1,'ZZ':1}
-bases=tuple(PauliBasis(b) for b in Ham)
+bases,lookup=group_paulis(Ham)
 
 counts=backend.run(circ.assign_parameters({theta_:theta}),bases)
 
-E=0
-for pauli in Ham:
-    for c in counts:
-        if c.contains(pauli):
-            E+=evaluate_pauli(pauli,c.results)
-            continue
+E,var=energy(Ham,counts,lookup)
 print(E)
@@ -0,0 +1,97 @@
+# quantum-computed-chemistry/extrapolation/adaptive.py
+# Chooses which circuit depths (and how many shots) to measure, stopping once the extrapolated zero noise value is precise enough
+
+#core
+from copy import copy
+
+#numpy
+from numpy import array,exp,linspace,sqrt,outer,isfinite
+from numpy.linalg import pinv
+
+#qcchem
+from backends.estimator import energy
+from backends.grouping import group_paulis
+from .fitting import fit_exponential
+
+def adaptive_sweep(backend,circuit,hamiltonian,depths,target,bases=None,lookup=None,shots=8192,initial=3,max_circuits=None,noise_limit=0,multipliers=(1,2,4),mitigator=None):
+    """
+    Measure a circuit at a few depths, fit the exponential decay, then repeatedly measure whichever depth (and number of shots) most reduces the error of the extrapolated zero noise value per unit cost
+        the cost of a measurement is taken to be shots*depth (per basis), so deep circuits are only measured when they are worth it
+    arguments:
+        backend (CountsBackend): the backend to run on
+        circuit (callable): circuit(depth) returns the state preparation circuit at a given depth, or a (circuit,parameters) tuple
+        hamiltonian (dict): Pauli strings as keys and coefficients as values
+        depths (iterable of int): the allowed depths
+        target (float): the required standard error of the zero noise value
+        bases, optional (iterable of PauliBasis): the measurement bases, by default the terms of the Hamiltonian are grouped using group_paulis
+        lookup, optional (dict): maps each term to its basis (see estimator.energy)
+        shots (int, default 8192): the number of measurements taken in each basis for a single measurement
+        initial (int, default 3): the number of depths measured before the first fit (spread over the shallower half of depths)
+        max_circuits, optional (int): stop once this many circuits have been run (default is the number run by a full sweep)
+        noise_limit (float, default 0): the initial estimate of the high noise limit
+        multipliers (iterable of int, default (1,2,4)): the multiples of shots considered for each new measurement
+        mitigator, optional (mitigation.ReadoutMitigator): if provided, the energies are corrected for readout errors
+    returns:
+        dict:
+            'depths','energies','errors' (lists): the pooled measurements at each measured depth
+            'fit' (FitResult): the final fit
+            'zero_noise','error' (float): the extrapolated value and its standard error
+            'circuits','shots' (int): the number of circuits run and total shots used
+            'saved_circuits','saved_shots' (int): the reduction compared to measuring every depth once
+    """
+    depths=sorted(depths)
+    if bases is None: bases,lookup=group_paulis(hamiltonian)
+    bases=tuple(bases)
+    if max_circuits is None: max_circuits=len(depths)*len(bases)
+    measured={}
+    used={'circuits':0,'shots':0}
+    def measure(depth,n_shots):
+        experiment=circuit(depth)
+        circ,parameters=experiment if isinstance(experiment,tuple) else (experiment,None)
+        results=backend.run(circ,[copy(basis) for basis in bases],n_shots,parameters)
+        E,var=energy(hamiltonian,results,lookup,mitigator)
+        used['circuits']+=len(bases)
+        used['shots']+=n_shots*len(bases)
+        #pool with any previous measurements at this depth (inverse variance weighting)
+        var=max(var,1/n_shots**2)
+        if depth in measured:
+            E0,var0,n0=measured[depth]
+            E,var,n_shots=(E0/var0+E/var)/(1/var0+1/var),1/(1/var0+1/var),n0+n_shots
+        measured[depth]=(E,var,n_shots)
+    for ix in sorted(set(linspace(0,(len(depths)-1)//2,initial).round().astype(int))): measure(depths[ix],shots)
+    while True:
+        x=sorted(measured)
+        y,var,_=array([measured[depth] for depth in x]).T
+        fit=fit_exponential(x,y,sqrt(var),d=noise_limit,scale_covar=False)
+        value,error=(v[0] for v in fit.zero_noise)
+        if error<=target or used['circuits']+len(bases)>max_circuits: break
+        choice=_next_measurement(fit,measured,depths,shots,multipliers,target)
+        if choice is None: break
+        measure(*choice)
+    return {'depths':x,'energies':list(y),'errors':list(sqrt(var)),'fit':fit,'zero_noise':float(value),'error':float(error),
+            'circuits':used['circuits'],'shots':used['shots'],
+            'saved_circuits':len(depths)*len(bases)-used['circuits'],'saved_shots':len(depths)*len(bases)*shots-used['shots']}
+
+def _next_measurement(fit,measured,depths,shots,multipliers,target):
+    """
+    Choose the (depth,shots) that most reduces the predicted variance of the zero noise value per unit cost, preferring the cheapest choice that reaches the target
+    """
+    A,b,d=fit.params[0]
+    if not isfinite(fit.params[0]).all(): return None
+    fisher=pinv(fit.covar[0])
+    h=array([1.,0.,1.])
+    current=h@fit.covar[0]@h
+    #the single shot variance of unmeasured depths is estimated from the measured depths
+    per_shot={depth:var*n for depth,(E,var,n) in measured.items()}
+    typical=sum(per_shot.values())/len(per_shot)
+    best=None
+    for depth in depths:
+        g=array([exp(b*depth),A*depth*exp(b*depth),1.])
+        for multiplier in multipliers:
+            predicted=h@pinv(fisher+outer(g,g)*multiplier*shots/per_shot.get(depth,typical))@h
+            cost=multiplier*shots*max(depth,1)
+            gain=(current-predicted)/cost
+            reaches=predicted<=target**2
+            key=(reaches,-cost if reaches else gain)
+            if gain>0 and (best is None or key>best[0]): best=(key,(depth,multiplier*shots))
+    return None if best is None else best[1]
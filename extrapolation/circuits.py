@@ -0,0 +1,72 @@
+# quantum-computed-chemistry/extrapolation/circuits.py
+# Builds noise-scaled circuits (a prefix followed by a repeated block) from blocks that are transpiled only once
+
+#qiskit
+from qiskit import QuantumCircuit,transpile
+
+class RepeatedCircuit():
+    """
+    A circuit made of a prefix followed by a block repeated a number of times, the prefix and block are transpiled once (with a fixed layout) and composed for each depth
+        circuits returned by RepeatedCircuit.build are marked as transpiled (with their layout), so CountsBackend.circ2circuits only appends the (cached) measurement for each basis, acting on the physical qubits of the layout
+        main methods:
+            RepeatedCircuit.build
+            RepeatedCircuit.sweep
+    """
+    def __init__(self,block,backend,prefix=None,initial_layout=None):
+        """
+        arguments:
+            block (qiskit.QuantumCircuit): the repeated block, parameters are shared by every repetition (e.g. use theta/reps as the value for a rotation split over the repetitions)
+            backend (BackendWrapper or qiskit backend): the backend the circuits will be run on
+            prefix, optional (qiskit.QuantumCircuit): the circuit applied before the first block, this should include any classical registers (by default one classical bit per qubit)
+            initial_layout, optional (list of int): the physical qubit used for each qubit of the block (default is the trivial layout)
+        """
+        self.backend=getattr(backend,'backend',backend)
+        if prefix is None: prefix=QuantumCircuit(block.num_qubits,block.num_qubits)
+        if initial_layout is None: initial_layout=list(range(block.num_qubits))
+        self.initial_layout=initial_layout
+        self._check_connectivity(block)
+        self.block=transpile(block,self.backend,initial_layout=initial_layout)
+        self.prefix=transpile(prefix,self.backend,initial_layout=initial_layout)
+        self.prefix.metadata=dict(self.prefix.metadata or {},transpiled=True,layout=list(initial_layout))
+        self._body,self._reps=self.prefix,0
+    def build(self,reps,parameters=None):
+        """
+        Generate the transpiled circuit for a given number of repetitions (extending the previously built circuit where possible, so building increasing depths takes linear time)
+        arguments:
+            reps (int): the number of repetitions of the block
+            parameters, optional (dict or sequence): values to bind to the parameters of the circuit
+        returns:
+            qiskit.QuantumCircuit: the transpiled circuit, marked as transpiled in its metadata (metadata['layout'] is the physical qubit of each qubit of the block)
+        """
+        if reps<self._reps: self._body,self._reps=self.prefix,0
+        if reps>self._reps:
+            body=self._body.copy()
+            for _ in range(reps-self._reps): body.compose(self.block,qubits=range(self.block.num_qubits),inplace=True)
+            self._body,self._reps=body,reps
+        circuit=self._body.copy() if parameters is None else self._body.assign_parameters(parameters)
+        circuit.metadata=dict(self._body.metadata)
+        return circuit
+    def sweep(self,reps_range,parameters=None):
+        """
+        Generate the circuits for a range of depths
+        arguments:
+            reps_range (iterable of int): the numbers of repetitions
+            parameters, optional (callable): parameters(reps) returns the values to bind at each depth
+        returns:
+            dict: reps as keys and transpiled circuits as values
+        """
+        return {reps:self.build(reps,None if parameters is None else parameters(reps)) for reps in sorted(reps_range)}
+    def _check_connectivity(self,block):
+        """
+        Blocks are composed without routing, so every two qubit gate must act on connected physical qubits
+        """
+        try: coupling=self.backend.configuration().coupling_map
+        except AttributeError: coupling=None
+        if not coupling: return
+        coupling={tuple(pair) for pair in coupling}
+        qubits={q:i for i,q in enumerate(block.qubits)}
+        for inst,qargs,cargs in block.data:
+            if len(qargs)!=2: continue
+            pair=tuple(self.initial_layout[qubits[q]] for q in qargs)
+            if pair not in coupling and pair[::-1] not in coupling:
+                raise ValueError(f'The block applies {inst.name} to the unconnected physical qubits {pair}, choose an initial_layout that connects them')
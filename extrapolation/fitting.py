@@ -0,0 +1,198 @@
+# quantum-computed-chemistry/extrapolation/fitting.py
+# Batched weighted least squares fits of noise-scaled energies (every point is fitted at once)
+
+#core
+from warnings import warn
+
+#numpy
+from numpy import asarray,atleast_2d,broadcast_to,exp,log,absolute,sign,sqrt,where,isfinite,zeros,ones,full,nan,stack,einsum,eye,inf,maximum,geomspace,errstate
+from numpy.linalg import solve,pinv,LinAlgError
+
+def exponential(x,A,b,d):
+    """
+    The exponential decay model: A*exp(b*x)+d
+    """
+    return A*exp(b*x)+d
+
+class FitResult():
+    """
+    The parameters of a batch of fits of the same model
+    attributes:
+        params (numpy.ndarray, shape (n_fits,n_params)): the fitted parameters, NaN where the fit failed
+        covar (numpy.ndarray, shape (n_fits,n_params,n_params)): the covariance of the fitted parameters
+        success (numpy.ndarray of bool, shape (n_fits,)): whether each fit converged
+        names (tuple of str): the names of the parameters
+    """
+    def __init__(self,model,names,params,covar,success):
+        self.model=model
+        self.names=names
+        self.params=params
+        self.covar=covar
+        self.success=success
+    def __call__(self,x):
+        """
+        Evaluate the fitted models
+        arguments:
+            x (array-like): the noise levels at which to evaluate the models
+        returns:
+            numpy.ndarray, shape (n_fits,len(x))
+        """
+        return self.model(asarray(x,dtype=float)[None,:],*(p[:,None] for p in self.params.T))
+    def __len__(self):
+        return len(self.params)
+    def __getitem__(self,ix):
+        return dict(zip(self.names,self.params[ix]))
+    @property
+    def zero_noise(self):
+        """
+        The extrapolated values at zero noise and their standard errors
+        returns:
+            values (numpy.ndarray, shape (n_fits,))
+            errors (numpy.ndarray, shape (n_fits,))
+        """
+        grad=zeros(self.params.shape)
+        if self.names==('A','b','d'): grad[:,[0,2]]=1
+        else: grad[:,0]=1
+        values=self(zeros(1))[:,0]
+        return values,sqrt(maximum(einsum('pi,pij,pj->p',grad,self.covar,grad),0))
+
+def fit_exponential(x,y,sigma=None,d=0,max_iter=200,tol=1e-10,scale_covar=True):
+    """
+    Fit A*exp(b*x)+d to every set of points at once (Levenberg-Marquardt, starting from a log-linear pre-fit)
+    arguments:
+        x (array-like, shape (n_x,) or (n_fits,n_x)): the noise levels (e.g. circuit repetitions)
+        y (array-like, shape (n_x,) or (n_fits,n_x)): the measured values, NaN values are ignored
+        sigma, optional (array-like, same shape as y): the error of each value, used to weight the fit
+        d (float or array-like, shape (n_fits,), default 0): the initial estimate of the high noise limit
+        max_iter (int, default 200): the maximum number of iterations
+        tol (float, default 1e-10): the fits converge when the relative change of the residual is smaller than tol
+        scale_covar (bool, default True): whether to scale the covariance by the reduced chi-squared
+    returns:
+        FitResult
+    """
+    x,y,w=_prepare(x,y,sigma)
+    #overflowing trial steps are rejected so numpy warnings are suppressed
+    with errstate(over='ignore',invalid='ignore'):
+        #log-linear pre-fit of y-d=A*exp(b*x)
+        d=broadcast_to(asarray(d,dtype=float),(len(y),))
+        offset=y-d[:,None]
+        A_sign=sign(einsum('pn,pn->p',w,offset))
+        A_sign[A_sign==0]=1
+        size=maximum(absolute(offset),1e-12)
+        (_,b),_=_lstsq(_powers(x,1),log(size),w*(offset*A_sign[:,None]>0)*size**2)
+        b=where(isfinite(b),b,0)
+        #for each decay rate A and d are linear, so take the best of the pre-fit and a range of decay rates
+        scale=maximum(absolute(x).max(axis=1),1e-12)
+        best=None
+        for rate in [b]+[-g/scale for g in geomspace(0.01,20,24)]:
+            (A,d),_=_lstsq(stack([exp(rate[:,None]*x),ones(x.shape)],axis=2),y,w)
+            params=stack([A,rate,d],axis=1)
+            r=y-exponential(x,*(p[:,None] for p in params.T))
+            cost=einsum('pn,pn,pn->p',w,r,r)
+            if best is None: best,best_cost=params,cost
+            else:
+                better=isfinite(cost)&~(cost>=best_cost)
+                best=where(better[:,None],params,best)
+                best_cost=where(better,cost,best_cost)
+        params=best
+        params[~isfinite(params)]=0
+        #Levenberg-Marquardt iterations
+        def residuals(params):
+            return (y-exponential(x,*(p[:,None] for p in params.T)))*sqrt(w)
+        def jacobian(params):
+            A,b,_=params.T
+            e=exp(b[:,None]*x)
+            return stack([e,A[:,None]*x*e,ones(x.shape)],axis=2)*sqrt(w)[:,:,None]
+        damping=full(len(y),1e-3)
+        r=residuals(params)
+        cost=einsum('pn,pn->p',r,r)
+        converged=zeros(len(y),dtype=bool)
+        for _ in range(max_iter):
+            J=jacobian(params)
+            JTJ=einsum('pni,pnj->pij',J,J)
+            step=_solve(JTJ+damping[:,None,None]*JTJ*eye(3)+1e-12*eye(3),einsum('pni,pn->pi',J,r))
+            trial=params+where(converged[:,None],0,step)
+            r_trial=residuals(trial)
+            cost_trial=einsum('pn,pn->p',r_trial,r_trial)
+            better=isfinite(cost_trial)&(cost_trial<=cost)
+            converged|=better&(cost-cost_trial<=tol*maximum(cost,1e-300))
+            params=where(better[:,None],trial,params)
+            r=where(better[:,None],r_trial,r)
+            cost=where(better,cost_trial,cost)
+            damping=where(better,damping/10,damping*10)
+            converged|=damping>1e12
+            if converged.all(): break
+    return _result(exponential,('A','b','d'),params,jacobian(params),cost,w,scale_covar)
+
+def fit_polynomial(x,y,sigma=None,order=1,scale_covar=True):
+    """
+    Fit a polynomial in the noise level to every set of points at once (order=1 is a linear extrapolation, order=n_x-1 is Richardson extrapolation)
+    arguments:
+        x (array-like, shape (n_x,) or (n_fits,n_x)): the noise levels (e.g. circuit repetitions)
+        y (array-like, shape (n_x,) or (n_fits,n_x)): the measured values, NaN values are ignored
+        sigma, optional (array-like, same shape as y): the error of each value, used to weight the fit
+        order (int, default 1): the order of the polynomial
+        scale_covar (bool, default True): whether to scale the covariance by the reduced chi-squared (ignored if there are no degrees of freedom)
+    returns:
+        FitResult: the parameters are the coefficients c0, c1, ... (c0 is the zero noise value)
+    """
+    x,y,w=_prepare(x,y,sigma)
+    V=_powers(x,order)
+    params,_=_lstsq(V,y,w)
+    params=params.T
+    r=(y-einsum('pnk,pk->pn',V,params))*sqrt(w)
+    return _result(_polynomial,tuple(f'c{k}' for k in range(order+1)),params,V*sqrt(w)[:,:,None],einsum('pn,pn->p',r,r),w,scale_covar)
+
+def _polynomial(x,*coeffs):
+    return sum(c*x**k for k,c in enumerate(coeffs))
+
+def _prepare(x,y,sigma):
+    """
+    Broadcast the inputs to (n_fits,n_x) arrays of noise levels, values and weights (zero weight for missing values)
+        errors of zero (e.g. a bootstrap of deterministic outcomes) are floored at the smallest positive error of the fit (or 1 if there is none), so the most precise points are not treated as missing
+    """
+    y=atleast_2d(asarray(y,dtype=float))
+    x=broadcast_to(asarray(x,dtype=float),y.shape)
+    if sigma is None: w=ones(y.shape)
+    else:
+        sigma=broadcast_to(asarray(sigma,dtype=float),y.shape)
+        with errstate(invalid='ignore'):
+            floor=where(isfinite(sigma)&(sigma>0),sigma,inf).min(axis=1,keepdims=True)
+            sigma=where(sigma<=0,where(isfinite(floor),floor,1),sigma)
+        w=1/sigma**2
+    w=where(isfinite(y)&isfinite(w),w,0)
+    return x,where(isfinite(y),y,0),w
+
+def _powers(x,order):
+    """
+    The design matrix (n_fits,n_x,order+1) of a polynomial
+    """
+    return stack([x**k for k in range(order+1)],axis=2)
+
+def _lstsq(V,y,w):
+    """
+    Batched weighted linear least squares fit y=V@c, returns the coefficients (n_coeffs,n_fits) and their unscaled covariance
+    """
+    covar=pinv(einsum('pnk,pn,pnl->pkl',V,w,V))
+    return einsum('pkl,pnl,pn,pn->kp',covar,V,w,y),covar
+
+def _solve(A,b):
+    """
+    Batched solve of A@x=b, falling back to the pseudo-inverse if any matrix is singular
+    """
+    try: return solve(A,b[:,:,None])[:,:,0]
+    except LinAlgError: return einsum('pij,pj->pi',pinv(A),b)
+
+def _result(model,names,params,J,cost,w,scale_covar):
+    """
+    Calculate the covariances of a batch of fits and mark failed fits
+    """
+    covar=pinv(einsum('pni,pnj->pij',J,J))
+    dof=(w>0).sum(axis=1)-len(names)
+    if scale_covar: covar=covar*where(dof>0,cost/maximum(dof,1),1)[:,None,None]
+    success=isfinite(params).all(axis=1)&isfinite(covar).all(axis=(1,2))&(dof>=0)
+    if not success.all():
+        warn(f'Fitting failed for {(~success).sum()} of {len(success)} points')
+        params=where(success[:,None],params,nan)
+        covar=where(success[:,None,None],covar,inf)
+    return FitResult(model,names,params,covar,success)
@@ -0,0 +1,246 @@
+# quantum-computed-chemistry/extrapolation/store.py
+# An append-only, on-disk store of sweep results, so an interrupted sweep can be resumed by skipping the completed measurements
+
+#core
+import os
+import json
+from hashlib import sha256
+from tempfile import mkstemp
+from numbers import Integral
+
+#numpy
+from numpy import asarray,memmap,zeros,flatnonzero
+
+#qcchem
+from backends.counts import Counts
+from backends.counts_backendwrapper import PauliBasis,_basis_shots
+from backends.resultcache import backend_fingerprint
+
+#the index columns (name, little endian dtype), length is written last so a record only exists once every other column has been written
+_INDEX=(('point','<f8'),('depth','<i8'),('repeat','<i8'),('basis','<i4'),('width','<i4'),('outcome_start','<i8'),('count_start','<i8'),('length','<i8'))
+
+class SweepStore():
+    """
+    Measured counts of a sweep, stored as one record per (point,depth,repeat,basis) in a directory of column files
+        the counts of each record are appended to outcomes.bin (64 bit words, see backends.counts.Counts) and counts.bin, then its index entry is appended to each index column (length last), so a crash at any point leaves a readable store (partially written records are discarded when the store is reopened)
+        columns are read lazily through memory maps
+        meta.json holds the bases, the configuration of the sweep (backend, shots, seed) and a digest of the circuit of each experiment, so a store is never resumed with different settings (see SweepStore.configure)
+        main methods:
+            SweepStore.configure
+            SweepStore.append
+            SweepStore.complete
+            SweepStore.results
+            SweepStore.table
+    """
+    def __init__(self,path,sync=False,config=None,experiments=None):
+        """
+        arguments:
+            path (str): the directory of the store (created if it doesn't exist, otherwise the existing records are kept)
+            sync (bool, default False): whether to flush every record to disk (os.fsync), rather than leaving it to the operating system
+            config, experiments, optional: checked against (or recorded in) the store, see SweepStore.configure
+        """
+        self.path=path
+        self.sync=sync
+        os.makedirs(path,exist_ok=True)
+        try:
+            with open(self._file('meta.json')) as f: meta=json.load(f)
+        except FileNotFoundError: meta={}
+        self.bases=meta.get('bases',[])
+        self.config=meta.get('config')
+        self.experiments=meta.get('experiments',{})
+        #discard any partially written record
+        sizes=[os.path.getsize(self._file(name)) if os.path.exists(self._file(name)) else 0 for name,_ in _INDEX]
+        self._n=min(size//int(dtype[-1]) for size,(_,dtype) in zip(sizes,_INDEX))
+        for name,dtype in _INDEX:
+            with open(self._file(name),'ab') as f: f.truncate(self._n*int(dtype[-1]))
+        self._maps={}
+        columns=self.table()
+        self._done={(float(p),int(d),int(r),self.bases[b]) for p,d,r,b in zip(columns['point'],columns['depth'],columns['repeat'],columns['basis'])}
+        if config is not None or experiments is not None: self.configure(config,experiments)
+    def configure(self,config=None,experiments=None):
+        """
+        Record the configuration of the sweep, or check that it matches the recorded configuration
+        arguments:
+            config, optional (dict): JSON serialisable settings that apply to every record (e.g. as returned by sweep_config)
+            experiments, optional (dict): keys are (point,depth) or (point,depth,repeat), values are digests of the circuits (see experiment_digest), new experiments are added to those recorded
+        raises:
+            ValueError: if the configuration, or the digest of a recorded experiment, is different (the store should be deleted or another path used), or the store has records but no recorded configuration
+        """
+        if config is not None:
+            config=json.loads(json.dumps(config))
+            if self.config is None and self._n: raise ValueError(f'The sweep store {self.path} has records but no recorded configuration, delete it or use another path')
+            if self.config is not None and self.config!=config:
+                changed=sorted(k for k in set(config)|set(self.config) if config.get(k)!=self.config.get(k))
+                raise ValueError(f'The sweep store {self.path} was written with a different configuration ({", ".join(changed)}), delete it or use another path')
+            self.config=config
+        if experiments is not None:
+            experiments={_label(key):digest for key,digest in experiments.items()}
+            changed=[label for label,digest in experiments.items() if self.experiments.get(label,digest)!=digest]
+            if len(changed): raise ValueError(f'The sweep store {self.path} holds different circuits for {len(changed)} experiments (e.g. {changed[0]}), delete it or use another path')
+            self.experiments.update(experiments)
+        self._write_meta()
+    def append(self,point,depth,repeat,basis,counts):
+        """
+        Store the counts of a single measurement
+        arguments:
+            point (float): the point (e.g. rotation angle) of the sweep
+            depth (int): the noise level (e.g. circuit repetitions)
+            repeat (int): the repetition of the measurement
+            basis (PauliBasis or str): the measurement basis
+            counts (dict or Counts): bitstrings as keys and frequencies as values, register separators are not stored
+        """
+        counts=Counts.from_dict(counts)
+        basis=str(getattr(basis,'basis',basis))
+        if basis not in self.bases:
+            self.bases.append(basis)
+            self._write_meta()
+        record={'point':point,'depth':depth,'repeat':repeat,'basis':self.bases.index(basis),'width':counts.width,'length':len(counts)}
+        record['outcome_start']=self._write('outcomes.bin',asarray(counts.outcomes).astype('<u8'))//8
+        record['count_start']=self._write('counts.bin',asarray(counts.counts).astype('<i8'))//8
+        for name,dtype in _INDEX: self._write(name,asarray([record[name]],dtype=dtype))
+        self._n+=1
+        self._done.add((float(point),int(depth),int(repeat),basis))
+    def extend(self,key,bases):
+        """
+        Store the results of every basis of an experiment
+        arguments:
+            key (tuple): (point,depth) or (point,depth,repeat)
+            bases (iterable of PauliBasis): the measured bases with results assigned (e.g. as returned by CountsBackend.run)
+        """
+        point,depth,repeat=(tuple(key)+(0,))[:3]
+        for basis in bases: self.append(point,depth,repeat,basis,basis.results)
+    def complete(self,key,bases):
+        """
+        Check whether every basis of an experiment has been stored
+        arguments:
+            key (tuple): (point,depth) or (point,depth,repeat)
+            bases (iterable of PauliBasis or str): the measurement bases
+        """
+        point,depth,repeat=(tuple(key)+(0,))[:3]
+        return all((float(point),int(depth),int(repeat),str(getattr(basis,'basis',basis))) in self._done for basis in bases)
+    def results(self,point,depth,repeat=0):
+        """
+        Load the bases measured for an experiment
+        arguments:
+            point (float), depth (int), repeat (int, default 0): the experiment
+        returns:
+            tuple of PauliBasis: in the order they were stored, results are Counts backed by memory maps of the store
+        """
+        columns=self.table()
+        rows=flatnonzero((columns['point']==point)&(columns['depth']==depth)&(columns['repeat']==repeat))
+        if not len(rows): raise KeyError(f'No results stored for point={point}, depth={depth}, repeat={repeat}')
+        outcomes=self._map('outcomes.bin','<u8')
+        counts=self._map('counts.bin','<i8')
+        out=()
+        for row in rows:
+            width,length=int(columns['width'][row]),int(columns['length'][row])
+            n_words=max(1,-(-width//64))
+            start,count_start=int(columns['outcome_start'][row]),int(columns['count_start'][row])
+            basis=PauliBasis(self.bases[columns['basis'][row]])
+            basis.results=Counts(outcomes[start:start+length*n_words].reshape(length,n_words),counts[count_start:count_start+length],width)
+            out+=(basis,)
+        return out
+    def table(self):
+        """
+        The index of every stored record
+        returns:
+            dict: column name as keys (point, depth, repeat, basis (position in SweepStore.bases), width, outcome_start, count_start, length), arrays as values
+        """
+        return {name:self._map(name,dtype)[:self._n] for name,dtype in _INDEX}
+    def keys(self):
+        """
+        returns:
+            set of (point,depth,repeat): every experiment with at least one stored basis
+        """
+        return {cell[:3] for cell in self._done}
+    def __len__(self):
+        return self._n
+    def _file(self,name):
+        return os.path.join(self.path,name)
+    def _write(self,name,values):
+        """
+        Append an array to a file, returning the offset (bytes) at which it was written
+        """
+        with open(self._file(name),'ab') as f:
+            start=f.tell()
+            f.write(values.tobytes())
+            if self.sync:
+                f.flush()
+                os.fsync(f.fileno())
+        return start
+    def _write_meta(self):
+        fd,tmp=mkstemp(dir=self.path,suffix='.tmp')
+        with os.fdopen(fd,'w') as f: json.dump({'bases':self.bases,'config':self.config,'experiments':self.experiments},f)
+        os.replace(tmp,self._file('meta.json'))
+    def _map(self,name,dtype):
+        """
+        A read only memory map of a column file, remapped when the file has grown
+        """
+        size=os.path.getsize(self._file(name)) if os.path.exists(self._file(name)) else 0
+        mapped=self._maps.get(name)
+        if mapped is None or mapped[0]!=size:
+            values=memmap(self._file(name),dtype=dtype,mode='r') if size else zeros(0,dtype=dtype)
+            self._maps[name]=mapped=(size,values)
+        return mapped[1]
+
+def _label(key):
+    """
+    The label of an experiment in meta.json
+    """
+    point,depth,repeat=(tuple(key)+(0,))[:3]
+    return repr((float(point),int(depth),int(repeat)))
+
+def experiment_digest(circuit,parameters=None):
+    """
+    A digest of the (bound) state preparation circuit of an experiment, the same in every process
+    arguments:
+        circuit (qiskit.QuantumCircuit): the circuit
+        parameters, optional (dict): values to bind to the parameters of circuit
+    returns:
+        str: a hexadecimal digest
+    """
+    if parameters is not None: circuit=circuit.assign_parameters(parameters)
+    return sha256(circuit.qasm().encode()).hexdigest()
+
+def sweep_config(backend,bases,shots=8192,seed=None):
+    """
+    The settings of a sweep that apply to every record of a store (see SweepStore.configure)
+    arguments:
+        see run_sweep
+    returns:
+        dict
+    """
+    bases=tuple(bases)
+    shots=_basis_shots(shots,bases)
+    return {'backend':backend_fingerprint(backend),'bases':[str(getattr(basis,'basis',basis)) for basis in bases],
+            'shots':int(shots) if isinstance(shots,Integral) else [int(n) for n in shots],'seed':seed}
+
+def run_sweep(store,backend,experiments,bases,shots=8192,seed=None,max_in_flight=4):
+    """
+    Measure the experiments of a sweep that are not already in the store, storing each result as soon as it is retrieved
+        the settings and circuits are first checked against those recorded in the store (see SweepStore.configure), so a store written with another backend, number of shots, seed or circuit raises ValueError rather than being reused
+    arguments:
+        store (SweepStore): the store
+        backend (CountsBackend): the backend to run on
+        experiments (dict): keys are (point,depth) or (point,depth,repeat), values are state preparation circuits or (circuit,parameters) tuples (see CountsBackend.sweep)
+        bases (iterable of PauliBasis): the bases in which each prepared state should be measured
+        shots (int, sequence of int or dict, default 8192): the number of measurements to be taken in each basis (see CountsBackend.run)
+        seed, optional (int): the seed used by simulators
+        max_in_flight (int, default 4): the maximum number of jobs running at once (see CountsBackend.stream)
+    returns:
+        int: the number of experiments that were run
+    """
+    bases=tuple(bases)
+    store.configure(sweep_config(backend,bases,shots,seed),{key:experiment_digest(*(experiment if isinstance(experiment,tuple) else (experiment,))) for key,experiment in experiments.items()})
+    todo={key:experiment for key,experiment in experiments.items() if not store.complete(key,bases)}
+    shots=_basis_shots(shots,bases)
+    if not isinstance(shots,Integral): shots=shots*len(todo)
+    def build():
+        for experiment in todo.values():
+            circuit,parameters=experiment if isinstance(experiment,tuple) else (experiment,None)
+            yield from backend.circ2circuits(circuit,bases,parameters)
+    labels=[(key,basis) for key in todo for basis in bases]
+    for ix,counts in backend.stream(build(),shots=shots,seed=seed,max_in_flight=max_in_flight):
+        key,basis=labels[ix]
+        if not store.complete(key,(basis,)): store.append(*(tuple(key)+(0,))[:3],basis,counts)
+    return len(todo)
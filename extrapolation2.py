@@ -1,106 +1,119 @@
 from backends.interface import get_backendwrapper
-from baceknds.counts_backendwrapper import PauliBasis
+from backends import instrument
+from backends.estimator import bootstrap_energy
+from backends.grouping import group_paulis
+from backends.mitigation import get_mitigator
+from backends.allocation import plan_shots
+from extrapolation.fitting import fit_exponential,exponential
+from extrapolation.adaptive import adaptive_sweep
+from extrapolation.circuits import RepeatedCircuit
+from extrapolation.store import SweepStore,run_sweep
 
 from qiskit import QuantumCircuit
 from qiskit.circuit.parameter import Parameter
 from qiskit import transpile
 
-from warnings import warn
 from copy import copy
 
-from numpy import pi,average,NaN,exp
-from statistics import stdev
-from lmfit import Model
+from numpy import pi,array
 from matplotlib import pyplot as plt
 
-#define the function to calculate the energy of Pauli strings
-def evaluate_pauli(pauli,results):
-    E=0
-    for bitstring,weight in results.items():
-        sign=1
-        for P,B in zip(pauli,bitstring):
-            if B=='1' and not P=='I': sign=-sign
-        E+=sign*weight
-    return E/sum(results.values())
-#define the function to use in fitting
-def exponential(x,A,b,d):
-    return A*exp(b*x)+d
-
 #get the backend
 backend=get_backendwrapper('sim1')
-#define the number of evaluations to average over
-number=2
+#define the number of bootstrap resamples used to estimate the error bars
+resamples=1000
 #define the points to evaluate at
 points=[0,pi/2,3*pi/4,pi,3*pi/2]
 #define the ideal values of the reference states (or None for the trial state)
 reference=[1,1,None,1,1]
 #define the circuit repetition depths to evaluate at
 reps_range=range(1,51,3)
+#define the target error of the extrapolated values to choose depths adaptively (or None to evaluate every depth)
+target=None
+#define the directory in which the measurements are stored as they arrive (rerunning resumes an interrupted sweep, skipping stored measurements, a sweep with a different backend, shots or circuit needs a new directory)
+store_path='sweep_store'
+#define the average number of shots per basis, and whether to distribute them over the bases according to a pilot run (evaluating every depth only)
+shots=8192
+allocation=False
+#define whether to correct the measurements for readout errors (calibrated once per backend)
+mitigation=False
+#define whether to time each stage of the sweep (a summary is printed at the end)
+profile=False
 
 #define the hamiltonian
 Ham={'XX':1,'YY':1,'ZZ':1}
 #define the measurement bases
-bases=tuple(PauliBasis(b) for b in Ham)
+bases,lookup=group_paulis(Ham)
 #define the high noise limit
 noise_limit=0
 
+#define the repeated block, the rotation angle is split evenly over the repetitions
+phi=Parameter('phi')
+block=QuantumCircuit(2)
+block.h(0)
+block.cx(0,1)
+block.ry(phi,0)
+block.ry(phi,1)
+block.barrier()
+block.cx(0,1)
+block.h(0)
+block.barrier()
+#define the state preparation before the repeated blocks
+prefix=QuantumCircuit(2,2)
+prefix.x(0)
+#transpile the block once, the circuit for each depth is composed from it
+builder=RepeatedCircuit(block,backend,prefix)
+
+if profile: instrument.enable()
+mitigator=get_mitigator(backend,2) if mitigation else None
 #create a dictionary to hold the data
-data={}
-for point in points:
-    data[point]=[]
+data={point:{} for point in points}
+if target is None:
+    #build every (point,depth) experiment so the whole sweep can be submitted together
+    experiments={}
     for circuit_reps in reps_range:
-      
-        #generate the circuit
-        circ=QuantumCircuit(2,2)
-        circ.x(0)
-        for i in range(circuit_reps):
-            circ.h(0)
-            circ.cx(0,1)
-            circ.ry(point/circuit_reps,0)
-            circ.ry(point/circuit_reps,1)
-            circ.barrier()
-            circ.cx(0,1)
-            circ.h(0)
-            circ.barrier()
-            
-        es=[]
-        for i in range(number):
-            #run the circuit
-            counts=backend.run(circ,bases)
-            e=0
-            #evaluate each term in the Hamiltonian
-            for pauli in Ham:
-                #check each measurement to see if it measured that term
-                for c in counts:
-                    if c.contains(pauli):
-                        #evaluate the term
-                        e+=evaluate_pauli(pauli,c.results)
-                        continue
-            es.append(e)
-        #store the data
-        data[point].append([average(es),stdev(es)])
-       
-#make the fits
-fits={}
-x=list(reps_range)
-for point in points:
-    y=[av for av,dev in data[point]]
-    model=Model(exponential)
-    p=model.make_params(A=y[0],b=-1,d=noise_limit)
-    try: result=model.fit(y,p,x=x)
-    except ValueError:
-        fits[point]=[NaN,NaN,NaN]
-        warn(f'Fitting failed for {point}')
-    else: fits[point]=[p.value for s,p in result.params.items()]
+        circ=builder.build(circuit_reps)
+        for point in points:
+            experiments[(point,circuit_reps)]=(circ,{phi:point/circuit_reps})
+
+    #the store records the backend, shots and circuits, and refuses to resume a sweep with different settings
+    store=SweepStore(store_path)
+    #allocate shots to each basis using the variances measured for the shallowest circuit (or reuse the allocation of the stored sweep)
+    if allocation and store.config is not None: shots=store.config['shots']
+    elif allocation:
+        circ,parameters=experiments[(points[0],min(reps_range))]
+        shots,_=plan_shots(backend,circ,Ham,bases,lookup,total=shots*len(bases),parameters=parameters)
+    #run the circuits that are not already stored
+    run_sweep(store,backend,experiments,bases,shots)
+
+    for point in points:
+        for circuit_reps in reps_range:
+            #evaluate all the terms in the Hamiltonian (with the error from resampling the counts) and store the data
+            data[point][circuit_reps]=list(bootstrap_energy(Ham,store.results(point,circuit_reps),lookup,resamples,mitigator=mitigator))
+           
+    #make the fits (all points at once, weighted by the error bars)
+    y,y_err=array([list(data[point].values()) for point in points]).transpose(2,0,1)
+    result=fit_exponential(list(reps_range),y,y_err,d=noise_limit)
+    fits={point:list(params) for point,params in zip(points,result.params)}
+else:
+    #measure and fit each point, only evaluating the depths needed to reach the target error
+    fits={}
+    for point in points:
+        result=adaptive_sweep(backend,lambda circuit_reps:(builder.build(circuit_reps),{phi:point/circuit_reps}),Ham,reps_range,target,bases,lookup,shots,noise_limit=noise_limit,mitigator=mitigator)
+        data[point]={circuit_reps:[E,err] for circuit_reps,E,err in zip(result['depths'],result['energies'],result['errors'])}
+        fits[point]=list(result['fit'].params[0])
+        print(f'Theta={point}: {result["saved_circuits"]} circuits and {result["saved_shots"]} shots saved')
 
+if profile: print(instrument.report(instrument.disable()))
 
 #plot the data
 for point in points:
-    y,y_err=zip(*data[point])
+    x=list(data[point])
+    y,y_err=zip(*data[point].values())
     fig_trial=plt.figure()
     ax=fig_trial.add_subplot(111)
     ax.errorbar(x,y,y_err,fmt='bx',ecolor='k')
-    X=[0]+list(circuit_reps_range)
+    X=[0]+list(reps_range)
     Y=[exponential(x,*fits[point]) for x in X]
     ax.plot(X,Y,'k-')
     ax.set_xlabel('Noise level')